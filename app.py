@@ -1,14 +1,24 @@
 import streamlit as st
-import google.generativeai as genai
 from src.models.database import init_db, Session, Content
-from src.processors.document_processor import DocumentProcessor, SUPPORTED_EXTENSIONS
-from src.processors.youtube_processor import YouTubeProcessor
-from src.processors.link_processor import LinkProcessor
-import os
-import tempfile
+from src.processors.document_processor import SUPPORTED_EXTENSIONS
+from src.services.retrieval import get_chunk_index
+from src.services.prompt_packer import pack_context
+from src.services.chat_engine import ChatEngine, history_from_messages
+from src.services.answer_cache import get_cached_answer, store_answer
+from src.services.llm_client import get_llm_client
+from src.services.model_scheduler import ModelBusyError, DeadlineExceeded
+from src.services import metrics
+from src.services.ingestion import stage_upload
+from src.services.search import search_content, matching_content_ids, PREFILTER_MIN_SOURCES
+from src.services.library import count_sources, list_sources, get_sources, get_source_details, SOURCES_PAGE_SIZE
+from src.services.job_queue import get_job_queue
+from src.processors.crawler import is_sitemap_url
+from src.services.context_cache import get_context_cache, format_catalog
+import time
 import logging
 from dotenv import load_dotenv
 from pathlib import Path
+from urllib.parse import urlparse
 
 # Page config must be the first Streamlit command
 st.set_page_config(
@@ -17,15 +27,26 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+@st.cache_data
+def load_css(path):
+    with open(path) as f:
+        return f.read()
+
+@st.cache_resource
+def initialize():
+    """Set up the database and metrics endpoint once per server process, not on every rerun."""
+    init_db()
+    metrics.start_metrics_server()
+
 # Load external CSS
-with open('static/css/style.css') as f:
-    st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
+st.markdown(f'<style>{load_css("static/css/style.css")}</style>', unsafe_allow_html=True)
 
 # Initialize
 load_dotenv()
-GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
-genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
-init_db()
+initialize()
+
+# How often the page refreshes while sources are being processed in the background
+JOB_REFRESH_SECONDS = 2
 
 # System instructions for different modes and learning styles
 SYSTEM_INSTRUCTIONS = {
@@ -87,80 +108,128 @@ if 'show_upload' not in st.session_state:
     st.session_state.show_upload = False
 if 'learning_style' not in st.session_state:
     st.session_state.learning_style = "detailed"
-if 'context_cache' not in st.session_state:
-    st.session_state.context_cache = None
+if 'stream_responses' not in st.session_state:
+    st.session_state.stream_responses = True
+if 'open_sources' not in st.session_state:
+    st.session_state.open_sources = set()
+if 'sources_page' not in st.session_state:
+    st.session_state.sources_page = 0
 if 'messages' not in st.session_state:
     st.session_state.messages = [
         {"role": "assistant", "content": "Hi! How can I help you with your studies today?"}
     ]
 
+ERROR_RESPONSE = "I apologize, but I encountered an error. Please try again or rephrase your question."
+BUSY_RESPONSE = "The AI service is busy right now (too many requests). Please wait a minute and ask again."
+SLOW_RESPONSE = "The AI service is taking too long to answer right now. Please try again in a moment."
+
 def get_context():
-    """Cache and return the context from the database."""
-    if st.session_state.context_cache is None:
-        session = Session()
-        contents = session.query(Content).all()
-        context = []
-        for content in contents:
-            source = {
-                "title": content.title,
-                "summary": content.summary,
-                "key_points": content.key_points if content.key_points else "",
-                "type": content.type if hasattr(content, 'type') else "document"
-            }
-            context.append(source)
-        st.session_state.context_cache = context
-    return st.session_state.context_cache
+    """Return the library version and list of sources (shared by all sessions)."""
+    return get_context_cache().get_sources()
+
+def render_study_instruction(style, sources):
+    """System instruction for study mode: learning style rules plus the library catalog."""
+    return (
+        f"{SYSTEM_INSTRUCTIONS['study_mentor'][style]}\n\n"
+        f"The student's library contains these sources:\n{format_catalog(sources)}\n\n"
+        "IMPORTANT: Each question comes with excerpts from the student's study materials. "
+        "These are the ONLY materials you should use to answer it. "
+        "If the answer isn't in these materials, say so and offer to help find related information."
+    )
+
+def get_chat_engine(mode, style=None):
+    """Return this session's chat engine, rebuilding it only when the instructions change."""
+    if mode == "general":
+        version, system_instruction = None, SYSTEM_INSTRUCTIONS["general"]
+    else:
+        # Rendered once per learning style and library version for all sessions
+        version, system_instruction = get_context_cache().get_prompt_block(
+            style, lambda sources: render_study_instruction(style, sources)
+        )
+    key = (mode, style, version)
+    engine = st.session_state.get('chat_engine')
+    if engine is None or st.session_state.get('chat_engine_key') != key:
+        # Carry the conversation so far (minus the question being asked) into the new engine
+        engine = ChatEngine(
+            system_instruction,
+            history=history_from_messages(st.session_state.messages[:-1]),
+            style=style or "general"
+        )
+        st.session_state.chat_engine = engine
+        st.session_state.chat_engine_key = key
+    return engine
 
-def process_user_input(user_input):
-    """Process user input with appropriate system instruction based on context and learning style."""
-    context = get_context()
+def process_user_input(user_input, stream=False):
+    """Process user input with appropriate system instruction based on context and learning style.
+    
+    Returns the answer text, or a generator of text chunks when stream is True.
+    """
+    library_version, context = get_context()
     
     try:
-        # Base model configuration
-        generation_config = genai.types.GenerationConfig(
-            temperature=0.7,
-            top_k=40,
-            top_p=0.8,
-            max_output_tokens=1024,
-        )
+        style = st.session_state.learning_style if context else "general"
+        # Opening questions don't depend on an earlier conversation, so the same
+        # question asked before (in any session) can be answered from the cache
+        cacheable = not any(message["role"] == "user" for message in st.session_state.messages[:-1])
+        if cacheable:
+            answer = get_cached_answer(user_input, style, library_version, get_llm_client().model_name)
+            if answer is not None:
+                engine = get_chat_engine("study_mentor", style) if context else get_chat_engine("general")
+                engine.remember(user_input, answer)
+                return iter([answer]) if stream else answer
         
         if not context:
             # Use general mode when no study materials are present
-            model = genai.GenerativeModel(GEMINI_MODEL)
-            chat = model.start_chat(history=[])
-            chat.send_message(SYSTEM_INSTRUCTIONS["general"])
+            engine = get_chat_engine("general")
+            formatted_context = None
         else:
-            # Format context for study mentor mode
-            formatted_context = "\n### YOUR STUDY MATERIALS:\n\n"
-            for idx, source in enumerate(context, 1):
-                formatted_context += f"#### {source['title']}\n\n"
-                formatted_context += f"**Content Summary:**\n{source['summary']}\n\n"
-                if source['key_points']:
-                    formatted_context += f"**Key Points:**\n{source['key_points']}\n\n"
-                formatted_context += "---\n\n"
-            
-            # Get appropriate system instruction based on learning style
-            style = st.session_state.learning_style
-            system_message = (
-                f"{SYSTEM_INSTRUCTIONS['study_mentor'][style]}\n\n"
-                "IMPORTANT: The following are the ONLY materials you should use to answer questions:\n\n"
-                f"{formatted_context}\n"
-                "Remember: ONLY use the information from these materials to answer questions. "
-                "If the answer isn't in these materials, say so and offer to help find related information."
-            )
-            
-            # Initialize model with context
-            model = genai.GenerativeModel(GEMINI_MODEL)
-            chat = model.start_chat(history=[])
-            chat.send_message(system_message)
+            # Only the chunks most relevant to the question go into the prompt, so its
+            # size stays bounded by the token budget no matter how large the library is
+            # Large libraries are narrowed down with the full-text index first
+            with metrics.span("retrieve", style) as sizes:
+                content_ids = matching_content_ids(user_input) if len(context) > PREFILTER_MIN_SOURCES else None
+                chunks = get_chunk_index().search(user_input, token_budget=None, content_ids=content_ids)
+                formatted_context, usage = pack_context(chunks)
+                sizes["prompt_tokens"] = sum(usage.values())
+            engine = get_chat_engine("study_mentor", st.session_state.learning_style)
         
-        # Send user's question
-        response = chat.send_message(user_input, generation_config=generation_config)
-        return response.text
+        cache_key = (style, library_version) if cacheable else None
+        if stream:
+            return stream_response(engine, user_input, formatted_context, cache_key)
+        answer = engine.send(user_input, context=formatted_context)
+        if cache_key:
+            store_answer(user_input, *cache_key, get_llm_client().model_name, answer)
+        return answer
         
+    except ModelBusyError as e:
+        logging.warning(f"Model busy in process_user_input: {str(e)}")
+        return iter([BUSY_RESPONSE]) if stream else BUSY_RESPONSE
+    except DeadlineExceeded as e:
+        logging.warning(f"Deadline exceeded in process_user_input: {str(e)}")
+        return iter([SLOW_RESPONSE]) if stream else SLOW_RESPONSE
+    except Exception as e:
+        logging.error(f"Error in process_user_input: {str(e)}")
+        return iter([ERROR_RESPONSE]) if stream else ERROR_RESPONSE
+
+def stream_response(engine, user_input, formatted_context, cache_key=None):
+    """Yield answer chunks, turning a failed request into the usual apology."""
+    try:
+        parts = []
+        for part in engine.stream(user_input, context=formatted_context):
+            parts.append(part)
+            yield part
+        # Only complete answers are worth serving again
+        if cache_key and engine.last_complete:
+            store_answer(user_input, *cache_key, get_llm_client().model_name, "".join(parts))
+    except ModelBusyError as e:
+        logging.warning(f"Model busy in process_user_input: {str(e)}")
+        yield BUSY_RESPONSE
+    except DeadlineExceeded as e:
+        logging.warning(f"Deadline exceeded in process_user_input: {str(e)}")
+        yield SLOW_RESPONSE
     except Exception as e:
         logging.error(f"Error in process_user_input: {str(e)}")
-        return "I apologize, but I encountered an error. Please try again or rephrase your question."
+        yield ERROR_RESPONSE
 
 def delete_source(source_id):
     """Delete a source from the database."""
@@ -169,14 +238,51 @@ def delete_source(source_id):
         if content:
             session.delete(content)
             session.commit()
-            st.session_state.context_cache = None
+            get_chunk_index().remove_content(source_id)
 
 def clear_all_sources():
     """Clear all sources from the database."""
     with Session() as session:
         session.query(Content).delete()
         session.commit()
-        st.session_state.context_cache = None
+        get_chunk_index().clear()
+
+JOB_STATE_ICONS = {"queued": "⏳", "running": "⚙️", "done": "✅", "failed": "❌"}
+
+def format_job_error(error):
+    """Add a hint to common ingestion errors."""
+    error = error or "Unknown error"
+    if "took too long to respond" in error:
+        return "⏱️ " + error
+    if "model is overloaded" in error:
+        return "🚦 " + error + "\nThe model's request quota is used up; please try again in a few minutes."
+    if "Error accessing website" in error:
+        return "🌐 " + error + "\nPlease check if the URL is correct and the website is accessible."
+    return "❌ " + error
+
+def render_ingestion_jobs():
+    """Show queued, running and recently finished ingestion jobs; returns True while any are active."""
+    queue = get_job_queue()
+    jobs = queue.recent_jobs()
+    
+    if not jobs:
+        return False
+    
+    st.write("### Processing")
+    for job in jobs:
+        label = f"{JOB_STATE_ICONS.get(job.state, '')} {job.title}"
+        if job.state == "running":
+            st.progress(job.progress or 0.0, text=f"{label}: {job.message}")
+        elif job.state == "failed":
+            st.error(f"{job.title}\n\n{format_job_error(job.error)}")
+        else:
+            st.caption(f"{label} - {job.message}")
+    
+    if any(job.state not in ("queued", "running") for job in jobs):
+        if st.button("Clear finished", key="clear_jobs"):
+            queue.clear_finished()
+            st.rerun()
+    return any(job.state in ("queued", "running") for job in jobs)
 
 def get_source_icon(title, source_type=None):
     """Get the appropriate icon based on source title/type."""
@@ -217,12 +323,17 @@ with st.sidebar:
     with sources_tab:
         st.title("Sources")
         
-        col1, col2 = st.columns([4, 1])
+        col1, col2, col3 = st.columns([3, 1, 1])
         with col1:
             if st.button("Add Source"):
                 st.session_state.show_upload = True
                 st.rerun()
         with col2:
+            # Re-analyzes only the website sources whose pages changed
+            if st.button("🔄", key="refresh_websites", help="Refresh website sources"):
+                get_job_queue().submit("refresh", "all", title="Refresh website sources")
+                st.rerun()
+        with col3:
             if st.button("Clear All"):
                 st.session_state.show_clear_confirm = True
                 st.rerun()
@@ -250,144 +361,127 @@ with st.sidebar:
                 st.write("Supported formats: PDF, Python, JavaScript, HTML, CSS, TXT, Markdown, CSV, XML, RTF")
                 uploaded_file = st.file_uploader("Upload Document", type=[ext[1:] for ext in SUPPORTED_EXTENSIONS])
                 if uploaded_file:
-                    temp_dir = tempfile.mkdtemp()
-                    temp_path = os.path.join(temp_dir, uploaded_file.name)
-                    
-                    try:
-                        with open(temp_path, 'wb') as f:
-                            f.write(uploaded_file.getvalue())
-                        
-                        with st.spinner("Processing document..."):
-                            processor = DocumentProcessor()
-                            content = processor.process_document(temp_path)
-                            
-                            if content:
-                                st.success(f"Successfully processed {uploaded_file.name}")
-                                st.session_state.context_cache = None
-                                st.session_state.show_upload = False
-                                st.rerun()
-                            else:
-                                st.error("Failed to process document")
-                    except Exception as e:
-                        st.error(f"Error processing document: {str(e)}")
-                    finally:
-                        if os.path.exists(temp_path):
-                            os.remove(temp_path)
-                        if os.path.exists(temp_dir):
-                            os.rmdir(temp_dir)
+                    # Processing runs in the background; the sidebar shows its progress
+                    file_path = stage_upload(uploaded_file.name, uploaded_file.getvalue())
+                    get_job_queue().submit("document", file_path, title=uploaded_file.name)
+                    st.session_state.show_upload = False
+                    st.rerun()
             
             elif upload_tab == "YouTube":  # YouTube tab
                 youtube_url = st.text_input("Enter YouTube URL")
                 if youtube_url:
-                    try:
-                        with st.spinner("Processing video..."):
-                            processor = YouTubeProcessor()
-                            # Create new session for processing
-                            with Session() as session:
-                                content = processor.process_video(youtube_url)
-                                if content:
-                                    # Update source type within the same session
-                                    content.source_type = "youtube"
-                                    session.add(content)
-                                    session.commit()
-                                    session.refresh(content)
-                                    
-                                    st.success("Successfully processed video")
-                                    st.session_state.context_cache = None
-                                    st.session_state.show_upload = False
-                                    st.rerun()
-                                else:
-                                    st.error("Failed to process video")
-                    except Exception as e:
-                        st.error(f"Error processing video: {str(e)}")
+                    get_job_queue().submit("youtube", youtube_url)
+                    st.session_state.show_upload = False
+                    st.rerun()
             
             else:  # Website Link tab
-                st.write("Enter a website URL to process its content")
+                st.write("Enter website URLs to process their content, one per line, or the URL of a sitemap.xml")
                 st.write("Note: Processing may take a few moments depending on the website size")
-                website_url = st.text_input("Enter Website URL (include http:// or https://)")
+                website_urls = st.text_area("Enter Website URLs (include http:// or https://)")
                 
-                if website_url:
-                    try:
-                        progress_placeholder = st.empty()
-                        with st.spinner("Processing website content..."):
-                            progress_placeholder.info("Fetching website content...")
-                            processor = LinkProcessor()
-                            
-                            # Process the link first
-                            progress_placeholder.info("Analyzing content...")
-                            content, title, url = processor.process_link(website_url)
-                            
-                            if content and title and url:
-                                # Create new session for database operations
-                                with Session() as session:
-                                    progress_placeholder.info("Saving processed content...")
-                                    
-                                    # Update content properties
-                                    content.title = title
-                                    content.source_type = "website"
-                                    content.url = url
-                                    
-                                    # Add and commit within the same session
-                                    session.add(content)
-                                    session.commit()
-                                    
-                                    progress_placeholder.success("Successfully processed website content")
-                                    st.session_state.context_cache = None
-                                    st.session_state.show_upload = False
-                                    st.rerun()
-                            else:
-                                progress_placeholder.error("Failed to process website content. The content might be too complex or not accessible.")
-                    except ValueError as e:
-                        st.error(str(e))
-                    except Exception as e:
-                        error_msg = str(e)
-                        if "took too long to respond" in error_msg:
-                            st.error("⏱️ " + error_msg)
-                        elif "Error accessing website" in error_msg:
-                            st.error("🌐 " + error_msg + "\nPlease check if the URL is correct and the website is accessible.")
+                if st.button("Process websites", disabled=not website_urls.strip()):
+                    urls = [url.strip() for url in website_urls.splitlines() if url.strip()]
+                    invalid = [url for url in urls if not (urlparse(url).scheme and urlparse(url).netloc)]
+                    if invalid:
+                        st.error(f"Invalid URL format: {invalid[0]}. Please include http:// or https://")
+                    else:
+                        if len(urls) == 1 and not is_sitemap_url(urls[0]):
+                            get_job_queue().submit("website", urls[0])
                         else:
-                            st.error("❌ " + error_msg)
+                            # Batches are crawled concurrently in a single job
+                            get_job_queue().submit("websites", "\n".join(urls), title=f"{len(urls)} website URLs" if len(urls) > 1 else urls[0])
+                        st.session_state.show_upload = False
+                        st.rerun()
             
             # Hide upload section button
             if st.button("❌ Cancel"):
                 st.session_state.show_upload = False
                 st.rerun()
         
-        # Get all sources
-        with Session() as session:
-            sources = session.query(Content).all()
-            
-            if not sources:
-                st.info("No sources added yet. Click 'Add Source' to get started!")
+        # Background ingestion progress
+        jobs_active = render_ingestion_jobs()
+        
+        # Get all sources, or the ones matching the search box ranked by relevance
+        search_query = st.text_input("Search sources", placeholder="🔍 Search sources...", label_visibility="collapsed")
+        snippets = {}
+        if search_query != st.session_state.get('last_search_query'):
+            st.session_state.last_search_query = search_query
+            st.session_state.sources_page = 0
+        
+        # Only one page of sources is loaded and rendered, so the sidebar costs the
+        # same however large the library is
+        if search_query:
+            snippets = {result["id"]: result["snippet"] for result in search_content(search_query)}
+            total_sources = len(snippets)
+        else:
+            total_sources = count_sources()
+        page_count = max(1, -(-total_sources // SOURCES_PAGE_SIZE))
+        # Deleting the last sources of the last page leaves it empty
+        page = min(st.session_state.sources_page, page_count - 1)
+        if search_query:
+            sources = get_sources(list(snippets)[page * SOURCES_PAGE_SIZE:(page + 1) * SOURCES_PAGE_SIZE])
+        else:
+            sources = list_sources(offset=page * SOURCES_PAGE_SIZE)
+        
+        if not sources:
+            if search_query:
+                st.info("No sources match your search.")
             else:
-                for source in sources:
-                    cols = st.columns([12, 1.5])
-                    with cols[0]:
-                        source_icon = get_source_icon(source.title, getattr(source, 'source_type', None))
-                        with st.expander(f"{source_icon} {source.title}", expanded=False):
-                            if source.summary:
-                                st.write("**Summary:** " + source.summary)
-                            if source.key_points:
-                                st.write("**Key Points:** " + source.key_points)
-                    with cols[1]:
-                        if st.button("❌", key=f"delete_{source.id}", help="Delete this source", use_container_width=True):
-                            st.session_state[f'confirm_delete_{source.id}'] = True
+                st.info("No sources added yet. Click 'Add Source' to get started!")
+        else:
+            for source in sources:
+                cols = st.columns([12, 1.5])
+                with cols[0]:
+                    source_icon = get_source_icon(source.title, getattr(source, 'source_type', None))
+                    details_open = source.id in st.session_state.open_sources
+                    with st.expander(f"{source_icon} {source.title}", expanded=details_open):
+                        if snippets.get(source.id):
+                            st.markdown("**Match:** " + snippets[source.id])
+                        if source.duplicate_of:
+                            st.caption("⚠️ Near-duplicate of another source in your library")
+                        # The summary is only fetched once asked for
+                        if details_open:
+                            details = get_source_details(source.id) or {}
+                            if details.get("summary"):
+                                st.write("**Summary:** " + details["summary"])
+                            if details.get("key_points"):
+                                st.write("**Key Points:** " + details["key_points"])
+                        elif st.button("Show summary", key=f"details_{source.id}"):
+                            st.session_state.open_sources.add(source.id)
+                            st.rerun()
+                with cols[1]:
+                    if st.button("❌", key=f"delete_{source.id}", help="Delete this source", use_container_width=True):
+                        st.session_state[f'confirm_delete_{source.id}'] = True
+                        st.rerun()
+                
+                # Show delete confirmation below the source
+                if st.session_state.get(f'confirm_delete_{source.id}', False):
+                    st.warning(f"Are you sure you want to delete '{source.title}'?")
+                    conf_col1, conf_col2 = st.columns(2)
+                    with conf_col1:
+                        if st.button("Yes", key=f"yes_{source.id}"):
+                            delete_source(source.id)
+                            st.session_state.pop(f'confirm_delete_{source.id}')
                             st.rerun()
-                    
-                    # Show delete confirmation below the source
-                    if st.session_state.get(f'confirm_delete_{source.id}', False):
-                        st.warning(f"Are you sure you want to delete '{source.title}'?")
-                        conf_col1, conf_col2 = st.columns(2)
-                        with conf_col1:
-                            if st.button("Yes", key=f"yes_{source.id}"):
-                                delete_source(source.id)
-                                st.session_state.pop(f'confirm_delete_{source.id}')
-                                st.rerun()
-                        with conf_col2:
-                            if st.button("No", key=f"no_{source.id}"):
-                                st.session_state.pop(f'confirm_delete_{source.id}')
-                                st.rerun()
-                    
+                    with conf_col2:
+                        if st.button("No", key=f"no_{source.id}"):
+                            st.session_state.pop(f'confirm_delete_{source.id}')
+                            st.rerun()
+            
+            # Pagination
+            if page_count > 1:
+                prev_col, page_col, next_col = st.columns([1, 2, 1])
+                with prev_col:
+                    if st.button("◀", key="sources_prev", disabled=page == 0):
+                        st.session_state.sources_page = page - 1
+                        st.rerun()
+                with page_col:
+                    st.caption(f"Page {page + 1} of {page_count} ({total_sources} sources)")
+                with next_col:
+                    if st.button("▶", key="sources_next", disabled=page >= page_count - 1):
+                        st.session_state.sources_page = page + 1
+                        st.rerun()
+                
     # Settings Tab
     with settings_tab:
         st.title("Settings")
@@ -409,6 +503,105 @@ with st.sidebar:
             st.session_state.learning_style = learning_style
             st.success(f"Learning style updated to: {learning_style}")
             st.rerun()
+        
+        st.session_state.stream_responses = st.toggle(
+            "Stream responses",
+            value=st.session_state.stream_responses,
+            help="Show the answer as it is being written instead of waiting for all of it"
+        )
+        
+        # Usage metrics
+        st.write("### Metrics")
+        questions = metrics.get_counter("chat_questions")
+        round_trips = metrics.get_counter("chat_round_trips")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Questions answered", int(questions))
+        with col2:
+            st.metric("Model round-trips per question", f"{round_trips / questions:.2f}" if questions else "-")
+        latency = metrics.snapshot()["summaries"]
+        if "chat_latency_seconds" in latency:
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Avg. time to first token", f"{latency['chat_time_to_first_token_seconds']['avg']:.2f}s")
+            with col2:
+                st.metric("Avg. answer time", f"{latency['chat_latency_seconds']['avg']:.2f}s")
+        cache_hits = metrics.get_counter("answer_cache_hits")
+        cache_lookups = cache_hits + metrics.get_counter("answer_cache_misses")
+        if cache_lookups:
+            st.metric("Answer cache hit rate", f"{cache_hits / cache_lookups:.0%}")
+        
+        # Where the time goes, per stage of ingestion and chat
+        snapshot = metrics.snapshot()
+        spans = snapshot["spans"]
+        if spans:
+            with st.expander("Performance"):
+                # Model request scheduler
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Model requests in flight", int(snapshot["gauges"].get("model_in_flight", 0)))
+                with col2:
+                    st.metric(
+                        "Waiting (chat / ingestion)",
+                        f"{int(snapshot['gauges'].get('model_queue_depth_interactive', 0))} / "
+                        f"{int(snapshot['gauges'].get('model_queue_depth_background', 0))}"
+                    )
+                with col3:
+                    waits = [snapshot["summaries"].get(f"model_queue_wait_seconds_{lane}") for lane in ("interactive", "background")]
+                    st.metric(
+                        "Avg. wait (chat / ingestion)",
+                        " / ".join(f"{wait['avg']:.1f}s" if wait else "-" for wait in waits)
+                    )
+                if snapshot["counters"].get("model_retries"):
+                    st.caption(f"{int(snapshot['counters']['model_retries'])} model requests retried after quota or server errors")
+                
+                # Chat latency per learning style, for tuning HEDGE_PERCENTILE and CHAT_DEADLINE_SECONDS
+                latency_rows = []
+                for style in ("general", "detailed", "bullet_points", "eli5"):
+                    for label, name in (("First token", "chat_time_to_first_token_seconds"), ("Answer", "chat_latency_seconds")):
+                        stats = snapshot["summaries"].get(f"{name}_{style}")
+                        if stats:
+                            latency_rows.append({
+                                "Style": style, "Latency": label, "Questions": stats["count"],
+                                "p50 (s)": round(stats["p50"], 2), "p95 (s)": round(stats["p95"], 2), "p99 (s)": round(stats["p99"], 2),
+                            })
+                if latency_rows:
+                    st.dataframe(latency_rows, hide_index=True, use_container_width=True)
+                hedged = snapshot["counters"].get("chat_hedged_requests", 0)
+                if hedged:
+                    st.caption(
+                        f"{int(hedged)} chat requests hedged, "
+                        f"{int(snapshot['counters'].get('chat_hedge_wins', 0))} answered first by the hedge"
+                    )
+                if snapshot["counters"].get("chat_deadline_exceeded"):
+                    st.caption(f"{int(snapshot['counters']['chat_deadline_exceeded'])} chat answers gave up at the deadline")
+                
+                st.dataframe(
+                    [
+                        {
+                            "Stage": stage,
+                            "Kind": kind or "",
+                            "Calls": stats["count"],
+                            "Errors": stats["errors"],
+                            "Avg (s)": round(stats["seconds"] / stats["count"], 3),
+                            "p95 (s) ≤": metrics.span_quantile(stats, 0.95),
+                            "Max (s)": round(stats["max_seconds"], 3),
+                            "MB": round(stats["bytes"] / 1024 / 1024, 2),
+                            "Prompt tokens": stats["prompt_tokens"],
+                            "Response tokens": stats["response_tokens"],
+                        }
+                        for (stage, kind), stats in sorted(spans.items(), key=lambda item: (item[0][0], item[0][1] or ""))
+                    ],
+                    hide_index=True,
+                    use_container_width=True
+                )
+                st.download_button(
+                    "Download metrics",
+                    metrics.render_prometheus(),
+                    file_name="studymate.prom",
+                    mime="text/plain",
+                    help="All metrics in Prometheus text format"
+                )
 
 # Display chat messages
 for message in st.session_state.messages:
@@ -426,9 +619,17 @@ if prompt := st.chat_input("Ask about your study materials..."):
 
     # Generate assistant response
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            response = process_user_input(prompt)
-            st.markdown(response)
+        if st.session_state.stream_responses:
+            response = st.write_stream(process_user_input(prompt, stream=True))
+        else:
+            with st.spinner("Thinking..."):
+                response = process_user_input(prompt)
+                st.markdown(response)
             
     # Add assistant response to chat history
-    st.session_state.messages.append({"role": "assistant", "content": response})
\ No newline at end of file
+    st.session_state.messages.append({"role": "assistant", "content": response})
+
+# Keep the sidebar's ingestion progress live while sources are being processed
+if jobs_active:
+    time.sleep(JOB_REFRESH_SECONDS)
+    st.rerun()
@@ -0,0 +1,110 @@
+"""Ingestion and chat throughput and latency, end to end, without network access.
+
+Runs the real pipeline (text extraction, analysis cache, near-duplicate check,
+database writes, chunk indexing, retrieval, prompt packing and the chat engine)
+against the fake LLM backend, in a scratch directory with its own database.
+Model latency is simulated, so the numbers show the app's own overhead and how
+well it overlaps model calls; FAKE_LLM_LATENCY_SECONDS and
+FAKE_LLM_TOKENS_PER_SECOND set how slow the pretend model is.
+
+Usage: python benchmarks/end_to_end.py [documents] [questions]
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Before the app modules are imported: they read these at import time, and the
+# database lives at database/studymate.db relative to the working directory
+os.environ.setdefault('LLM_BACKEND', 'fake')
+os.environ.setdefault('FAKE_LLM_LATENCY_SECONDS', '0.3')
+WORKDIR = tempfile.mkdtemp(prefix='studymate-bench-')
+os.makedirs(os.path.join(WORKDIR, 'database'))
+os.chdir(WORKDIR)
+
+import logging
+logging.disable(logging.INFO)
+
+from src.models.database import init_db
+from src.services.ingestion import stage_upload, ingest_document
+from src.services.job_queue import INGESTION_WORKERS
+from src.services.retrieval import get_chunk_index
+from src.services.prompt_packer import pack_context
+from src.services.chat_engine import ChatEngine
+from src.services.llm_client import get_llm_client
+
+TOPICS = [
+    "gradient descent", "backpropagation", "photosynthesis", "supply and demand", "the french revolution",
+    "plate tectonics", "linear regression", "cell division", "thermodynamics", "graph algorithms",
+]
+WORDS = "the a of and to in is that it for as with by on this are from at be which".split()
+
+def synthetic_notes(index, words=1500):
+    """Lecture notes on a topic; every document gets different filler so none are near-duplicates."""
+    rng = random.Random(index)
+    topic = TOPICS[index % len(TOPICS)]
+    sentences = []
+    while sum(len(s.split()) for s in sentences) < words:
+        filler = " ".join(rng.choices(WORDS, k=8))
+        sentences.append(f"In lecture {index}, {topic} step {rng.randint(0, 10**6)} {filler} example {rng.random():.6f}.")
+    return f"# Lecture {index}: {topic}\n\n" + " ".join(sentences)
+
+def percentiles(values):
+    ordered = sorted(values)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+    return f"p50 {pick(50) * 1000:7.0f} ms  p95 {pick(95) * 1000:7.0f} ms  p99 {pick(99) * 1000:7.0f} ms"
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def bench_ingestion(documents):
+    paths = [stage_upload(f"lecture-{i}.md", synthetic_notes(i).encode('utf-8')) for i in range(documents)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=INGESTION_WORKERS) as executor:
+        latencies = list(executor.map(lambda path: timed(ingest_document, path), paths))
+    seconds = time.perf_counter() - start
+    print(f"Ingestion: {documents} documents in {seconds:.2f}s with {INGESTION_WORKERS} workers, "
+          f"{documents / seconds:.2f} documents/s")
+    print(f"  per document  {percentiles(latencies)}")
+
+def bench_chat(questions):
+    engine = ChatEngine("You are a helpful study assistant.")
+    first_tokens, totals = [], []
+    for i in range(questions):
+        question = f"Explain {TOPICS[i % len(TOPICS)]} with an example from lecture {i}"
+        start = time.perf_counter()
+        context, _ = pack_context(get_chunk_index().search(question, token_budget=None))
+        first_token = None
+        for _ in engine.stream(question, context=context):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+        totals.append(time.perf_counter() - start)
+        first_tokens.append(first_token)
+        engine.history = []  # Independent questions, like the answer cache's opening questions
+    print(f"Chat: {questions} questions, {questions / sum(totals):.2f} questions/s")
+    print(f"  first token   {percentiles(first_tokens)}")
+    print(f"  full answer   {percentiles(totals)}")
+
+def main():
+    documents = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    questions = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    init_db()
+    backend = get_llm_client().backend
+    print(f"Backend: {type(backend).__name__}")
+    try:
+        bench_ingestion(documents)
+        bench_chat(questions)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
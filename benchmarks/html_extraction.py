@@ -0,0 +1,91 @@
+"""Per-page CPU time and peak memory of turning a web page into analysis input.
+
+Compares the former temp-file path (clean the DOM with html.parser, serialize it,
+write it to a temporary file, read it back and parse it again) with the
+in-memory single-parse extractors of LinkProcessor.
+
+Usage: python benchmarks/html_extraction.py [page.html ...]
+Without arguments a synthetic course page (~75KB, half of it scripts and navigation) is used.
+"""
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from src.processors import link_processor
+from src.processors.link_processor import LinkProcessor
+from src.processors.text_extraction import extract_text
+
+ITERATIONS = 20
+
+def synthetic_page(paragraphs=400):
+    body = "\n".join(
+        f"<p>Paragraph {i}: gradient descent updates the <b>weights</b> of layer {i % 12} "
+        f"using the learning rate and the <a href='#ref{i}'>partial derivatives</a>.</p>"
+        for i in range(paragraphs)
+    )
+    scripts = "\n".join(f"<script>var tracker{i} = {{id: {i}, data: '{'x' * 200}'}};</script>" for i in range(40))
+    nav = "<nav>" + "".join(f"<a href='/page{i}'>Page {i}</a>" for i in range(200)) + "</nav>"
+    return (
+        f"<html><head><title>Lecture 7: Backpropagation</title><style>body {{color: #333}}</style>{scripts}</head>"
+        f"<body>{nav}<main><h1>Backpropagation</h1>{body}</main><footer>Footer links</footer></body></html>"
+    )
+
+def temp_file_path(processor, html, url):
+    """The pre-change path, reproduced for comparison."""
+    soup = BeautifulSoup(html, 'html.parser')
+    title = soup.title.string if soup.title else url
+    for element in soup.find_all(['script', 'style', 'nav', 'footer', 'iframe', 'meta', 'link']):
+        element.decompose()
+    main_content = soup.select_one('main') or soup.find('body') or soup
+    cleaned_html = f"<html><head><title>{title}</title></head><body><h1>{title}</h1>{str(main_content)}</body></html>"
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8') as temp_file:
+        temp_file.write(cleaned_html)
+        temp_path = temp_file.name
+    try:
+        return extract_text(temp_path, 'text/html')
+    finally:
+        os.remove(temp_path)
+
+def in_memory(extractor):
+    def run(processor, html, url):
+        link_processor.HTML_EXTRACTOR = extractor
+        return processor.extract_page(html, url)[1]
+    return run
+
+def measure(run, processor, html):
+    tracemalloc.start()
+    run(processor, html, "https://example.com/page")
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.process_time()
+    for _ in range(ITERATIONS):
+        run(processor, html, "https://example.com/page")
+    return (time.process_time() - start) / ITERATIONS, peak
+
+def main():
+    pages = [open(path, encoding='utf-8', errors='replace').read() for path in sys.argv[1:]] or [synthetic_page()]
+    processor = LinkProcessor()
+    paths = [("temp file (before)", temp_file_path), ("in memory, bs4", in_memory('bs4'))]
+    if link_processor.lxml_html is not None:
+        paths.append(("in memory, lxml", in_memory('lxml')))
+    else:
+        print("lxml is not installed; skipping the lxml extractor")
+
+    for html in pages:
+        print(f"\nPage of {len(html) / 1024:.0f}KB")
+        baseline = None
+        for name, run in paths:
+            cpu, peak = measure(run, processor, html)
+            baseline = baseline or (cpu, peak)
+            print(
+                f"  {name:20s} {cpu * 1000:7.1f} ms CPU/page ({cpu / baseline[0]:.0%})  "
+                f"{peak / 1024 / 1024:6.1f} MB peak ({peak / baseline[1]:.0%})"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Cold start: how long the app takes to import and to render its first page.
+
+Every measurement runs in a fresh Python process, in a scratch directory with
+its own empty database, against the fake LLM backend:
+
+- import: the modules app.py and the CLI import, and which heavy libraries
+  they pull in beyond Streamlit's own (those should only load when their
+  source type is first used);
+- first render: app.py run once by Streamlit's AppTest (imports, database
+  setup and the page), then rerun as on every widget interaction.
+
+Usage: python benchmarks/startup.py [runs]
+"""
+import os
+import sys
+import ast
+import json
+import shutil
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Libraries only some sources need
+HEAVY_MODULES = ["google.generativeai", "yt_dlp", "cv2", "PIL", "bs4", "requests", "PyPDF2"]
+
+IMPORT_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import streamlit
+streamlit_seconds = time.perf_counter() - start
+loaded = set(sys.modules)
+start = time.perf_counter()
+for module in {modules!r}:
+    __import__(module)
+print(json.dumps({{"streamlit": streamlit_seconds, "modules": time.perf_counter() - start,
+                  "heavy": [name for name in {heavy!r} if name in sys.modules and name not in loaded]}}))
+"""
+
+CLI_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import src.cli
+print(json.dumps({{"modules": time.perf_counter() - start,
+                  "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+RENDER_PROBE = """
+import time, json
+from streamlit.testing.v1 import AppTest, element_tree
+# AppTest can't map the value of a selectbox with a format_func back to its
+# option on rerun; the page's own default index is what a first visit sends
+element_tree.Selectbox.index = property(lambda self: self.proto.default)
+app = AppTest.from_file("app.py", default_timeout=120)
+start = time.perf_counter()
+app.run()
+first = time.perf_counter() - start
+start = time.perf_counter()
+app.run()
+rerun = time.perf_counter() - start
+print(json.dumps({"first": first, "rerun": rerun, "exceptions": [str(e.value) for e in app.exception]}))
+"""
+
+def app_modules():
+    """The src modules app.py imports, in order."""
+    with open(os.path.join(ROOT, 'app.py')) as f:
+        tree = ast.parse(f.read())
+    return [node.module for node in tree.body if isinstance(node, ast.ImportFrom) and node.module.startswith('src.')]
+
+def run_probe(code, workdir):
+    env = dict(os.environ, PYTHONPATH=workdir, LLM_BACKEND=os.environ.get('LLM_BACKEND', 'fake'))
+    result = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=env, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def fresh_workdir():
+    """A project folder sharing the code but with no database yet."""
+    workdir = tempfile.mkdtemp(prefix='studymate-startup-')
+    for name in ('app.py', 'src', 'static'):
+        os.symlink(os.path.join(ROOT, name), os.path.join(workdir, name))
+    os.makedirs(os.path.join(workdir, 'database'))
+    return workdir
+
+def summary(values):
+    return f"median {statistics.median(values) * 1000:6.0f} ms  min {min(values) * 1000:6.0f} ms"
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    heavy = {"app": set(), "cli": set()}
+    results = {"streamlit": [], "app imports": [], "cli imports": [], "first render": [], "rerun": []}
+    for _ in range(runs):
+        workdir = fresh_workdir()
+        try:
+            imports = run_probe(IMPORT_PROBE.format(modules=app_modules(), heavy=HEAVY_MODULES), workdir)
+            cli = run_probe(CLI_PROBE.format(heavy=HEAVY_MODULES), workdir)
+            render = run_probe(RENDER_PROBE, workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        if render["exceptions"]:
+            raise RuntimeError(f"app.py failed to render: {render['exceptions']}")
+        results["streamlit"].append(imports["streamlit"])
+        results["app imports"].append(imports["modules"])
+        results["cli imports"].append(cli["modules"])
+        results["first render"].append(render["first"])
+        results["rerun"].append(render["rerun"])
+        heavy["app"].update(imports["heavy"])
+        heavy["cli"].update(cli["heavy"])
+    print(f"Startup over {runs} fresh processes (LLM_BACKEND={os.environ.get('LLM_BACKEND', 'fake')})")
+    for name, values in results.items():
+        print(f"  {name:<13} {summary(values)}")
+    for name, modules in heavy.items():
+        print(f"  heavy libraries loaded by {name} imports: {', '.join(sorted(modules)) or 'none'}")
+
+if __name__ == "__main__":
+    main()
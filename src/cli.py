@@ -0,0 +1,220 @@
+"""Bulk ingestion without the web UI.
+
+    python -m src.cli course-notes/ slides.zip --manifest links.txt --workers 6
+
+Documents come from directories (searched recursively), zip archives and
+individual files; a manifest lists one YouTube, web page or sitemap URL per
+line (# starts a comment). Run it from the project folder, like the app.
+
+Every item becomes an ingestion job in the database, so the app shows them as
+they run and an interrupted import picks up where it stopped when the same
+command is run again. Items already in the library are skipped.
+"""
+import os
+import sys
+import time
+import shutil
+import hashlib
+import zipfile
+import logging
+import argparse
+from pathlib import Path
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+from .models.database import init_db, Session, Content, IngestionJob
+from .processors.document_processor import SUPPORTED_EXTENSIONS
+from .processors.crawler import is_sitemap_url
+from .services.analysis_cache import hash_file
+from .services.ingestion import INGESTERS
+from .services.job_queue import JobQueue, INGESTION_WORKERS, ACTIVE_STATES
+from .services import metrics
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Zip archives are unpacked here, one folder per archive. A folder is removed once
+# none of its documents has an unfinished job; an interrupted import keeps it to resume
+IMPORT_DIR = os.path.join('database', 'imports')
+
+YOUTUBE_HOSTS = ('youtube.com', 'youtu.be')
+
+def is_youtube_url(url):
+    host = urlparse(url).netloc.lower()
+    return any(host == name or host.endswith('.' + name) for name in YOUTUBE_HOSTS)
+
+def _documents_in(folder):
+    return sorted(
+        str(path) for path in Path(folder).rglob('*')
+        if path.is_file() and path.suffix.lower() in SUPPORTED_EXTENSIONS
+        and not any(part.startswith('.') for part in path.relative_to(folder).parts)
+    )
+
+def unpack_archive(archive_path):
+    """Unpack a zip archive into IMPORT_DIR (once) and return its folder."""
+    with open(archive_path, 'rb') as file:
+        digest = hashlib.sha256(file.read()).hexdigest()[:16]
+    folder = os.path.join(IMPORT_DIR, digest)
+    if not os.path.isdir(folder):
+        with zipfile.ZipFile(archive_path) as archive:
+            archive.extractall(folder)  # Member paths are sanitized by zipfile
+    return folder
+
+def read_manifest(manifest_path):
+    with open(manifest_path, encoding='utf-8') as file:
+        lines = (line.split('#', 1)[0].strip() for line in file)
+        return [line for line in lines if line]
+
+def collect_items(paths, manifests):
+    """The (kind, source) jobs for the given inputs, in order and without repeats.
+
+    Returns:
+        tuple: (items, {unpacked archive folder: its documents})
+    """
+    items = []
+    archives = {}
+    for path in paths:
+        if os.path.isdir(path):
+            items += [("document", document) for document in _documents_in(path)]
+        elif zipfile.is_zipfile(path):
+            folder = unpack_archive(path)
+            archives[folder] = _documents_in(folder)
+            items += [("document", document) for document in archives[folder]]
+        elif Path(path).suffix.lower() in SUPPORTED_EXTENSIONS:
+            items.append(("document", path))
+        else:
+            logger.warning(f"Skipping {path}: not a folder, zip archive or supported document")
+
+    urls = [url for manifest in manifests for url in read_manifest(manifest)]
+    sitemaps = [url for url in urls if is_sitemap_url(url)]
+    if sitemaps:
+        # Sitemaps are expanded here so every page is its own job, skipped or resumed on its own
+        from .processors.link_processor import LinkProcessor
+        pages = LinkProcessor().expand_sitemaps(sitemaps)
+        print(f"{len(sitemaps)} sitemaps list {len(pages)} pages")
+        urls = [url for url in urls if not is_sitemap_url(url)] + pages
+    for url in urls:
+        items.append(("youtube" if is_youtube_url(url) else "website", url))
+    return list(dict.fromkeys(items)), archives
+
+def remove_archives(archives, unfinished=()):
+    """Delete unpacked archive folders none of whose documents is in unfinished."""
+    unfinished = set(unfinished)
+    for folder, documents in archives.items():
+        if not unfinished.intersection(documents):
+            shutil.rmtree(folder, ignore_errors=True)
+
+def plan(items):
+    """Split items into (already in the library, unfinished jobs to resume as {item: job id}, new)."""
+    with Session() as session:
+        hashes = {hash for (hash,) in session.query(Content.content_hash).filter(Content.content_hash.isnot(None))}
+        urls = {url for (url,) in session.query(Content.source_url).filter(Content.source_url.isnot(None))}
+        active = {
+            (job.kind, job.source): job.id
+            for job in session.query(IngestionJob).filter(IngestionJob.state.in_(ACTIVE_STATES))
+        }
+    ingested, resume, new = [], {}, []
+    for kind, source in items:
+        if (kind, source) in active:
+            resume[(kind, source)] = active[(kind, source)]
+        elif source in urls or (kind == "document" and hash_file(source) in hashes):
+            ingested.append((kind, source))
+        else:
+            new.append((kind, source))
+    return ingested, resume, new
+
+def wait_for(queue, job_ids, poll_seconds=1.0):
+    """Print progress until every job has finished; returns {job id: (state, error)}.
+
+    Jobs another process holds are waited for, and taken over if its lease expires.
+    """
+    last_line = None
+    while True:
+        queue.resume(job_ids)
+        with Session() as session:
+            jobs = session.query(IngestionJob.id, IngestionJob.state, IngestionJob.error).filter(
+                IngestionJob.id.in_(job_ids)
+            ).all()
+        states = {job.id: (job.state, job.error) for job in jobs}
+        done = sum(1 for state, _ in states.values() if state == 'done')
+        failed = sum(1 for state, _ in states.values() if state == 'failed')
+        line = f"{done + failed}/{len(job_ids)} finished ({failed} failed)"
+        if line != last_line:
+            print(line, flush=True)
+            last_line = line
+        if done + failed == len(job_ids):
+            return states
+        time.sleep(poll_seconds)
+
+def print_summary(items, skipped, states, seconds, sources):
+    done = [job_id for job_id, (state, _) in states.items() if state == 'done']
+    failed = {job_id: error for job_id, (state, error) in states.items() if state == 'failed'}
+    print(f"\n{len(items)} items: {len(done)} ingested, {len(skipped)} already in the library, {len(failed)} failed")
+    if states:
+        print(f"{seconds:.1f}s, {len(done) / seconds:.2f} items/s, {len(done) * 60 / seconds:.1f} items/min")
+    spans = metrics.snapshot()["spans"]
+    parsed = sum(stats["bytes"] for (stage, _), stats in spans.items() if stage == "parse")
+    if parsed:
+        print(f"{parsed / 1e6:.2f} MB parsed, {parsed / 1e6 / seconds:.2f} MB/s")
+    model_calls = [stats for (stage, _), stats in spans.items() if stage == "model_call"]
+    if model_calls:
+        print(
+            f"{sum(s['count'] for s in model_calls)} model calls, "
+            f"{sum(s['prompt_tokens'] for s in model_calls)} prompt tokens, "
+            f"{sum(s['response_tokens'] for s in model_calls)} response tokens"
+        )
+    for job_id, error in failed.items():
+        print(f"  failed: {sources[job_id]}: {error}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.cli", description="Add many sources to the StudyMate library.")
+    parser.add_argument("paths", nargs="*", help="folders, zip archives or documents")
+    parser.add_argument("--manifest", action="append", default=[], help="file with one URL per line (repeatable)")
+    parser.add_argument("--workers", type=int, default=INGESTION_WORKERS, help="sources processed in parallel")
+    parser.add_argument("--dry-run", action="store_true", help="list what would be ingested and exit")
+    parser.add_argument("--verbose", action="store_true", help="show the processors' log")
+    args = parser.parse_args(argv)
+    if not args.paths and not args.manifest:
+        parser.error("nothing to ingest: give folders, archives, documents or --manifest")
+    # The processors log every step at INFO; a bulk import only needs the summary
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    init_db()
+    items, archives = collect_items(args.paths, args.manifest)
+    skipped, resume, new = plan(items)
+    print(f"{len(items)} items: {len(new)} new, {len(resume)} to resume, {len(skipped)} already in the library")
+    if args.dry_run:
+        for kind, source in new + list(resume):
+            print(f"  {kind}: {source}")
+        # Unfinished jobs of an earlier run still need their unpacked documents
+        remove_archives(archives, unfinished=[source for _, source in resume])
+        return 0
+    if not new and not resume:
+        remove_archives(archives)
+        return 0
+
+    # Only this import's own unfinished jobs are taken over, not those of the app
+    queue = JobQueue(INGESTERS, max_workers=args.workers, recover=False)
+    start_time = time.time()
+    job_ids = list(resume.values())
+    job_ids += [
+        queue.submit(kind, source, title=os.path.basename(source) if kind == "document" else None)
+        for kind, source in new
+    ]
+    sources = {job_id: source for (_, source), job_id in resume.items()}
+    with Session() as session:
+        sources.update(session.query(IngestionJob.id, IngestionJob.source).filter(IngestionJob.id.in_(job_ids)).all())
+    try:
+        states = wait_for(queue, job_ids)
+    except KeyboardInterrupt:
+        print("\nInterrupted; run the same command again to resume.")
+        # Worker threads can't be stopped; their jobs stay unfinished in the database,
+        # free for the next run (or the app) to take over without waiting for the lease
+        queue.release_leases()
+        os._exit(130)
+    # Every job has finished; documents that failed are unpacked again by the next run
+    remove_archives(archives)
+    print_summary(items, skipped, states, time.time() - start_time, sources)
+    return 1 if any(state == 'failed' for state, _ in states.values()) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, String, Text, DateTime, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
@@ -10,22 +10,60 @@ load_dotenv()
 # Ensure database directory exists
 os.makedirs('database', exist_ok=True)
 
+# Connection handling for concurrent use
+#
+# Every Streamlit session runs in its own thread, and ingestion jobs run on
+# worker threads, all sharing this engine. Each thread checks a connection out
+# of the QueuePool only for the duration of a `with Session() as session:`
+# block, so the pool just needs to cover the threads that touch the database
+# at the same moment (DB_POOL_SIZE, plus DB_MAX_OVERFLOW under bursts).
+# SQLite in WAL mode lets readers run alongside the single writer, and the
+# busy timeout makes a second writer wait for the lock instead of failing
+# with "database is locked".
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 30000))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+
 Base = declarative_base()
-engine = create_engine('sqlite:///database/studymate.db', connect_args={'check_same_thread': False})
-Session = sessionmaker(bind=engine)
+engine = create_engine(
+    'sqlite:///database/studymate.db',
+    connect_args={'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000},
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=30
+)
+# Objects stay readable after their session is closed, so sessions can be short-lived
+Session = sessionmaker(bind=engine, expire_on_commit=False)
+
+@event.listens_for(engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    """Per-connection SQLite settings."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")  # Readers don't block the writer and vice versa
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL; fsync only at checkpoints
+    cursor.execute("PRAGMA cache_size=-32000")  # 32MB page cache per connection
+    cursor.execute("PRAGMA mmap_size=268435456")  # Read through a 256MB memory map
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
 
 class Content(Base):
     __tablename__ = 'content'
     
     id = Column(Integer, primary_key=True)
-    type = Column(String(50))  # youtube, pdf, webpage
+    type = Column(String(50), index=True)  # youtube, pdf, webpage
     source_url = Column(String(500))
     title = Column(String(200))
     content = Column(Text)
     summary = Column(Text)
     key_points = Column(Text)
-    source_type = Column(String)  # Added for source type tracking
-    created_at = Column(DateTime, default=datetime.utcnow)
+    source_type = Column(String, index=True)  # Added for source type tracking
+    content_hash = Column(String(64), index=True)  # SHA-256 of the ingested bytes
+    duplicate_of = Column(Integer)  # Source this one is a near-duplicate of (DEDUP_MODE=flag)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    # Not stored: True on a source that processing returned instead of creating a new
+    # one (same bytes, or a near-duplicate with DEDUP_MODE=merge); its row is left as is
+    already_ingested = False
 
 class UserQuery(Base):
     __tablename__ = 'user_queries'
@@ -35,6 +73,165 @@ class UserQuery(Base):
     response = Column(Text)
     content_id = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Answer cache fields: a response can be reused for the same question asked
+    # with the same learning style, library version and model
+    normalized_query = Column(Text, index=True)
+    style = Column(String(50))
+    library_version = Column(Integer)
+    model = Column(String(100))
+    hits = Column(Integer, default=0)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class ContentChunk(Base):
+    __tablename__ = 'content_chunks'
+    
+    id = Column(Integer, primary_key=True)
+    content_id = Column(Integer, index=True)  # Content row this chunk was cut from
+    position = Column(Integer)  # Order of the chunk within its source
+    text = Column(Text)
+    token_count = Column(Integer)
+
+class AnalysisCache(Base):
+    __tablename__ = 'analysis_cache'
+    
+    cache_key = Column(String(64), primary_key=True)  # Hash of content hash + prompt version + model
+    content_hash = Column(String(64), index=True)
+    prompt_version = Column(String(20))
+    model = Column(String(100))
+    summary = Column(Text)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class IngestionJob(Base):
+    __tablename__ = 'ingestion_jobs'
+    
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(20))  # document, youtube, website, websites (batch), refresh
+    source = Column(String(500))  # File path or URL(s) to ingest
+    title = Column(String(200))  # Display name while the job runs
+    state = Column(String(20), default='queued', index=True)  # queued, running, done, failed
+    progress = Column(Float, default=0.0)  # 0.0 - 1.0
+    message = Column(Text)
+    error = Column(Text)
+    content_id = Column(Integer)  # Content row created by the job
+    # Lease: the queue (app or CLI process) working on an active job renews
+    # heartbeat_at; once it goes stale another queue may take the job over
+    worker_id = Column(String(64))
+    heartbeat_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ContentFingerprint(Base):
+    __tablename__ = 'content_fingerprints'
+    
+    content_id = Column(Integer, primary_key=True)
+    simhash = Column(Integer)  # 64-bit SimHash of the source text, stored signed
+    # The SimHash in four 16-bit bands, for indexed near-duplicate lookups
+    band0 = Column(Integer, index=True)
+    band1 = Column(Integer, index=True)
+    band2 = Column(Integer, index=True)
+    band3 = Column(Integer, index=True)
+
+class HttpCacheEntry(Base):
+    __tablename__ = 'http_cache'
+    
+    url = Column(String(500), primary_key=True)
+    etag = Column(String(200))
+    last_modified = Column(String(100))
+    body_hash = Column(String(64))  # SHA-256 of the last downloaded body
+    fetched_at = Column(DateTime, default=datetime.utcnow)  # Last time the body was downloaded
+    checked_at = Column(DateTime, default=datetime.utcnow)  # Last time the page was revalidated
+
+class LibraryVersion(Base):
+    __tablename__ = 'library_version'
+    
+    id = Column(Integer, primary_key=True)  # Single row
+    version = Column(Integer, default=0)  # Bumped by triggers whenever the set of sources changes
+
+def _add_missing_columns():
+    """Add columns and indexes introduced after a table was first created (create_all only creates tables)."""
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+# Full-text index over the searchable Content columns. It is an external-content
+# FTS5 table (the text lives only in `content`), kept in sync by triggers.
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS content_fts USING fts5(
+        title, summary, key_points, content,
+        content='content', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS content_fts_insert AFTER INSERT ON content BEGIN
+        INSERT INTO content_fts(rowid, title, summary, key_points, content)
+        VALUES (new.id, new.title, new.summary, new.key_points, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS content_fts_delete AFTER DELETE ON content BEGIN
+        INSERT INTO content_fts(content_fts, rowid, title, summary, key_points, content)
+        VALUES ('delete', old.id, old.title, old.summary, old.key_points, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS content_fts_update AFTER UPDATE ON content BEGIN
+        INSERT INTO content_fts(content_fts, rowid, title, summary, key_points, content)
+        VALUES ('delete', old.id, old.title, old.summary, old.key_points, old.content);
+        INSERT INTO content_fts(rowid, title, summary, key_points, content)
+        VALUES (new.id, new.title, new.summary, new.key_points, new.content);
+    END""",
+]
+
+def _create_search_index():
+    """Create the FTS5 search index, populating it from existing rows the first time."""
+    with engine.begin() as connection:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'content_fts'"
+        ).first()
+        for statement in SEARCH_INDEX_DDL:
+            connection.exec_driver_sql(statement)
+        if not exists:
+            connection.exec_driver_sql("INSERT INTO content_fts(content_fts) VALUES ('rebuild')")
+
+# Anything cached from the list of sources or their analyses (e.g. chat answers)
+# stays valid while this version is unchanged. The triggers bump it on every
+# insert and delete, and on updates of the columns shown in the library listing
+# or given to the model, whichever process or thread wrote.
+# The update trigger is recreated so databases from before a column was added get it.
+LIBRARY_VERSION_DDL = [
+    "INSERT OR IGNORE INTO library_version (id, version) VALUES (1, 0)",
+    """CREATE TRIGGER IF NOT EXISTS library_version_insert AFTER INSERT ON content BEGIN
+        UPDATE library_version SET version = version + 1 WHERE id = 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS library_version_delete AFTER DELETE ON content BEGIN
+        UPDATE library_version SET version = version + 1 WHERE id = 1;
+    END""",
+    "DROP TRIGGER IF EXISTS library_version_update",
+    """CREATE TRIGGER library_version_update AFTER UPDATE OF title, type, summary, key_points, content ON content BEGIN
+        UPDATE library_version SET version = version + 1 WHERE id = 1;
+    END""",
+    # Not about the version, but the same kind of bookkeeping: fingerprints go with their source
+    """CREATE TRIGGER IF NOT EXISTS content_fingerprints_delete AFTER DELETE ON content BEGIN
+        DELETE FROM content_fingerprints WHERE content_id = old.id;
+    END""",
+]
+
+def _create_library_version_triggers():
+    with engine.begin() as connection:
+        for statement in LIBRARY_VERSION_DDL:
+            connection.exec_driver_sql(statement)
+
+def get_library_version():
+    """Current library version (see LIBRARY_VERSION_DDL)."""
+    with engine.connect() as connection:
+        return connection.exec_driver_sql("SELECT version FROM library_version WHERE id = 1").scalar() or 0
 
 def init_db():
+    _add_missing_columns()
     Base.metadata.create_all(engine)
+    _create_search_index()
+    _create_library_version_triggers()
@@ -0,0 +1,111 @@
+import os
+import time
+import logging
+import threading
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+CRAWL_WORKERS = int(os.getenv('CRAWL_WORKERS', 8))
+# At most this many requests run against one host at a time...
+CRAWL_CONNECTIONS_PER_HOST = int(os.getenv('CRAWL_CONNECTIONS_PER_HOST', 2))
+# ...and requests to one host start at least this far apart
+CRAWL_DELAY_SECONDS = float(os.getenv('CRAWL_DELAY_SECONDS', 0.5))
+MAX_CRAWL_PAGES = int(os.getenv('MAX_CRAWL_PAGES', 200))
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def parse_sitemap(xml_text):
+    """Read a sitemap.xml.
+
+    Returns:
+        tuple: (page URLs, nested sitemap URLs) — a sitemap index only has the latter
+    """
+    root = ET.fromstring(xml_text)
+    locations = [
+        element.text.strip() for element in root.iter()
+        if _local_name(element.tag) == 'loc' and element.text and element.text.strip()
+    ]
+    if _local_name(root.tag) == 'sitemapindex':
+        return [], locations
+    return locations, []
+
+def is_sitemap_url(url):
+    return urlparse(url).path.lower().endswith('.xml')
+
+class HostLimiter:
+    """Per-host connection limit and politeness delay shared by all crawl workers."""
+
+    def __init__(self, connections_per_host=CRAWL_CONNECTIONS_PER_HOST, delay=CRAWL_DELAY_SECONDS):
+        self.connections_per_host = connections_per_host
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._slots = defaultdict(lambda: threading.BoundedSemaphore(self.connections_per_host))
+        self._next_start = defaultdict(float)
+
+    def _slot(self, host):
+        with self._lock:
+            return self._slots[host]
+
+    def run(self, url, request):
+        """Call request() once the URL's host has a free connection and its delay has passed."""
+        host = urlparse(url).netloc.lower()
+        with self._slot(host):
+            with self._lock:
+                start = max(time.monotonic(), self._next_start[host])
+                self._next_start[host] = start + self.delay
+            wait = start - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            return request()
+
+def crawl(urls, fetch_page, max_workers=CRAWL_WORKERS, limiter=None, progress_callback=None):
+    """Fetch and process pages concurrently.
+
+    fetch_page(url) runs on a worker thread and should both download and parse
+    the page, so parsing overlaps with the network waits of other pages. It
+    returns (result, size in bytes).
+
+    Returns:
+        tuple: ({url: result} for the pages that worked, {url: error message},
+        report dict with pages, failures, bytes, seconds and pages_per_second)
+    """
+    urls = list(dict.fromkeys(urls))
+    limiter = limiter or HostLimiter()
+    results, failures = {}, {}
+    total_bytes = 0
+    start_time = time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='crawl') as executor:
+        futures = {executor.submit(limiter.run, url, lambda url=url: fetch_page(url)): url for url in urls}
+        for done, future in enumerate(as_completed(futures), start=1):
+            url = futures[future]
+            try:
+                result, size = future.result()
+                results[url] = result
+                total_bytes += size
+            except Exception as e:
+                logger.warning(f"Failed to fetch {url}: {str(e)}")
+                failures[url] = str(e)
+            if progress_callback:
+                progress_callback(done, len(urls), f"Fetched {done}/{len(urls)} pages")
+
+    seconds = time.time() - start_time
+    report = {
+        "pages": len(results),
+        "failures": len(failures),
+        "bytes": total_bytes,
+        "seconds": seconds,
+        "pages_per_second": len(results) / seconds if seconds else 0.0,
+    }
+    logger.info(
+        f"Crawled {report['pages']} pages ({total_bytes / 1024:.0f}KB) in {seconds:.2f}s, "
+        f"{report['pages_per_second']:.2f} pages/s, {report['failures']} failed"
+    )
+    return results, failures, report
@@ -1,11 +1,19 @@
-import google.generativeai as genai
 from pathlib import Path
 from ..models.database import Session, Content
+from ..services.retrieval import get_chunk_index
+from ..services.analysis_cache import hash_file, hash_bytes, make_cache_key, get_cached_analysis, store_analysis
+from ..services.map_reduce import map_parts
+from ..services.dedup import check_duplicate, store_fingerprint
+from ..services.llm_client import get_llm_client
+from ..services import metrics
+from .text_extraction import extract_text, extract_pdf_pages, csv_digest
 import os
 from dotenv import load_dotenv
 import logging
 import base64
 import mimetypes
+import io
+import threading
 
 # Configure logging
 logging.basicConfig(
@@ -16,8 +24,12 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 load_dotenv()
-GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
-genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+# PDFs with more pages than this are summarized in parallel page ranges
+LARGE_DOCUMENT_PAGES = int(os.getenv('LARGE_DOCUMENT_PAGES', 40))
+PAGES_PER_PART = int(os.getenv('PAGES_PER_PART', 20))
+
+# Bump whenever the analysis prompt changes so cached analyses are not reused
+ANALYSIS_PROMPT_VERSION = "2"
 
 # Supported MIME types and their file extensions
 SUPPORTED_TYPES = {
@@ -40,7 +52,7 @@ SUPPORTED_EXTENSIONS = [ext for exts in SUPPORTED_TYPES.values() for ext in exts
 
 class DocumentProcessor:
     def __init__(self):
-        self.model = genai.GenerativeModel(GEMINI_MODEL)
+        self.llm = get_llm_client()
     
     def _get_file_mime_type(self, file_path):
         """Get MIME type of the file."""
@@ -53,10 +65,20 @@ class DocumentProcessor:
                     return mime
         return mime_type
     
-    def _encode_file(self, file_path):
-        """Encode file to base64."""
-        with open(file_path, 'rb') as file:
-            return base64.b64encode(file.read()).decode('utf-8')
+    def _encode_file(self, file_path, data=None):
+        """Encode file (or its in-memory bytes) to base64."""
+        with metrics.span("encode", "document") as sizes:
+            if data is None:
+                with open(file_path, 'rb') as file:
+                    data = file.read()
+            sizes["bytes"] = len(data)
+            return base64.b64encode(data).decode('utf-8')
+    
+    def _text_part(self, file_path, text):
+        """Extracted text as sent to the model; large CSVs are reduced to a digest."""
+        if Path(file_path).suffix.lower() == '.csv':
+            text = csv_digest(text)
+        return f"DOCUMENT: {os.path.basename(file_path)}\n\n{text}"
     
     def _get_document_type_prompt(self, file_path):
         """Get document-type specific prompt additions."""
@@ -81,19 +103,129 @@ Additional Analysis Points:
 - Data quality observations
 - Potential use cases
 """
-        elif ext in ['.html', '.xml']:
+        elif ext in ['.html', '.htm']:
+            # Web pages and HTML uploads are sent as their extracted text, without markup
+            return """
+This is the text extracted from a web page; its markup, layout and images are not included, so do not describe them.
+
+Additional Analysis Points:
+- Headings and how the content is organized under them
+- Main topics and the key information on each
+- Lists, tables or step-by-step instructions in the text
+- Other pages, sources or resources the text refers to
+"""
+        elif ext == '.xml':
             return """
 Additional Analysis Points:
 - Document structure
 - Key elements and attributes
-- Layout and organization
-- Linked resources
-- Accessibility considerations
+- What the data describes and how it is organized
 """
         return ""  # Default no additional prompts
     
-    def process_document(self, file_path):
-        """Process document using Gemini's document understanding capabilities."""
+    def _count_pdf_pages(self, file_path):
+        """Number of pages in a PDF, or 0 if it cannot be read."""
+        from PyPDF2 import PdfReader
+        try:
+            return len(PdfReader(file_path).pages)
+        except Exception as e:
+            logger.warning(f"Could not read PDF page count: {str(e)}")
+            return 0
+    
+    def _split_pdf(self, page_count, content_hash):
+        """Split a PDF's pages into ranges for map-reduce summarization."""
+        parts = []
+        for start in range(0, page_count, PAGES_PER_PART):
+            end = min(start + PAGES_PER_PART, page_count)
+            label = f"pages {start + 1}-{end}"
+            parts.append({
+                "label": label,
+                "content_hash": content_hash,
+                "cache_key": make_cache_key(f"{content_hash}:{label}", ANALYSIS_PROMPT_VERSION, self.llm.model_name),
+                "payload": (start, end)
+            })
+        return parts
+    
+    def _pdf_range_bytes(self, reader, start, end):
+        """Write pages [start, end) of a PDF into a new in-memory PDF."""
+        from PyPDF2 import PdfWriter
+        writer = PdfWriter()
+        for page in reader.pages[start:end]:
+            writer.add_page(page)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        return buffer.getvalue()
+    
+    def _summarize_page_range(self, range_part, start, end):
+        """Map step: summarize one page range of a large PDF, given as extracted text or inline PDF data."""
+        prompt = f"""You are a helpful study assistant. These are pages {start + 1}-{end} of a longer document.
+Write detailed study notes for this section: the concepts, definitions, arguments, examples, formulas and any
+figures or tables it contains. These notes will be combined with notes on the other sections later, so do not
+write an introduction or conclusion for the whole document."""
+        response = self.llm.generate(
+            contents=[prompt, range_part],
+            config="section"
+        )
+        return response.text
+    
+    def _summarize_large_pdf(self, file_path, page_count, content_hash, prompt, page_texts=None, progress_callback=None):
+        """Map-reduce analysis of a large PDF: summarize page ranges concurrently, then merge.
+        
+        When the PDF has a text layer (page_texts), each range is sent as its extracted text.
+        """
+        logger.info(f"Large document mode: {page_count} pages in parts of {PAGES_PER_PART}")
+        from PyPDF2 import PdfReader
+        parts = self._split_pdf(page_count, content_hash)
+        reader = PdfReader(file_path)
+        reader_lock = threading.Lock()
+        
+        def summarize(payload):
+            start, end = payload
+            if page_texts:
+                range_part = "\n\n".join(page_texts[start:end])
+            else:
+                # PdfReader is not thread-safe; only the page copy is serialized, not the model call
+                with reader_lock:
+                    range_bytes = self._pdf_range_bytes(reader, start, end)
+                range_part = {
+                    "mime_type": "application/pdf",
+                    "data": base64.b64encode(range_bytes).decode('utf-8')
+                }
+            return self._summarize_page_range(range_part, start, end)
+        
+        partials = map_parts(parts, summarize, ANALYSIS_PROMPT_VERSION, self.llm.model_name, progress_callback=progress_callback)
+        
+        if progress_callback:
+            progress_callback(len(parts), len(parts), "Merging section summaries...")
+        notes = "\n\n".join(f"## Notes on {part['label']}\n{partial}" for part, partial in zip(parts, partials))
+        merge_prompt = (
+            f"{prompt}\n\n"
+            f"The document is long ({page_count} pages), so it was read in sections. "
+            "Base your analysis on the following section notes, covering the whole document:\n\n"
+            f"{notes}"
+        )
+        # Longer documents get a larger output budget for the merged analysis
+        response = self.llm.generate(
+            contents=[merge_prompt],
+            config="analysis",
+            max_output_tokens=min(8192, 2048 + 256 * len(parts))
+        )
+        logger.info("Merged section summaries")
+        return response.text
+    
+    def process_document(self, file_path, progress_callback=None, data=None, text=None, dedup=True):
+        """Process document using Gemini's document understanding capabilities.
+        
+        PDFs longer than LARGE_DOCUMENT_PAGES are analyzed in page ranges. progress_callback,
+        if given, is called as progress_callback(done, total, message) while they are processed.
+        
+        The document can also be passed in memory, without a file: as data (its bytes, or a
+        str for text formats) or as text already extracted from it. file_path then only names
+        the document, and its extension picks the type.
+        
+        A near-duplicate of a source already in the library is handled per DEDUP_MODE
+        before any model call, unless dedup is False.
+        """
         logger.info(f"Starting document processing: {file_path}")
         try:
             # Check if file type is supported
@@ -101,15 +233,20 @@ Additional Analysis Points:
             if not mime_type or not any(mime_type.startswith(supported) for supported in SUPPORTED_TYPES.keys()):
                 raise ValueError(f"Unsupported file type: {mime_type}")
             
-            # Prepare the document for Gemini
-            encoded_doc = self._encode_file(file_path)
+            # In-memory content as bytes, for hashing and for sending as-is
+            source = text if text is not None else data
+            raw = source.encode('utf-8') if isinstance(source, str) else source
             
-            # Create the document part
-            document_part = {
-                "mime_type": mime_type,
-                "data": encoded_doc
-            }
-            logger.info(f"Document encoded and prepared for analysis. MIME type: {mime_type}")
+            # Look up identical content analyzed with the same prompt and model
+            content_hash = hash_bytes(raw) if raw is not None else hash_file(file_path)
+            cache_key = make_cache_key(content_hash, ANALYSIS_PROMPT_VERSION, self.llm.model_name)
+            with Session() as session:
+                existing = session.query(Content).filter(Content.content_hash == content_hash).first()
+            summary = get_cached_analysis(cache_key)
+            if summary is not None and existing is not None:
+                logger.info(f"Document already ingested as '{existing.title}', skipping analysis")
+                existing.already_ingested = True
+                return existing
             
             # Get any additional prompts based on file type
             type_specific_prompt = self._get_document_type_prompt(file_path)
@@ -144,32 +281,90 @@ Additional Analysis Points:
 
 Please format your response with clear headers and bullet points. For any technical terms, provide brief explanations."""
 
-            logger.info("Generating content analysis...")
-            response = self.model.generate_content(
-                contents=[prompt, document_part],
-                generation_config={
-                    "temperature": 0.7,
-                    "top_k": 40,
-                    "top_p": 0.8,
-                    "max_output_tokens": 2048,
-                }
-            )
-            logger.info("Content analysis completed")
+            # Extract the text locally; the raw file is only sent when there is no text to extract
+            page_count = 0
+            page_texts = None
+            pdf_source = io.BytesIO(raw) if raw is not None else file_path
+            with metrics.span("parse", "document") as sizes:
+                sizes["bytes"] = len(raw) if raw is not None else os.path.getsize(file_path)
+                if text is None and mime_type == 'application/pdf':
+                    page_count = self._count_pdf_pages(pdf_source)
+                    page_texts = extract_pdf_pages(pdf_source)
+                    text = '\n\n'.join(page_texts) if page_texts else None
+                elif text is None:
+                    text = extract_text(file_path, mime_type, data=data)
+            
+            # Mirrors and re-uploads of a source already in the library
+            duplicate_of = None
+            if summary is None and existing is None and dedup:
+                duplicate, duplicate_of = check_duplicate(text)
+                if duplicate is not None:
+                    logger.info(f"Near-duplicate of '{duplicate.title}', skipping analysis")
+                    duplicate.already_ingested = True
+                    return duplicate
+            
+            if summary is None and page_count > LARGE_DOCUMENT_PAGES:
+                summary = self._summarize_large_pdf(pdf_source, page_count, content_hash, prompt, page_texts, progress_callback)
+                store_analysis(cache_key, content_hash, ANALYSIS_PROMPT_VERSION, self.llm.model_name, summary)
+            
+            if summary is None:
+                if text is not None:
+                    document_part = self._text_part(file_path, text)
+                    logger.info(
+                        f"Sending {len(document_part)} characters of extracted text "
+                        f"instead of {len(raw) if raw is not None else os.path.getsize(file_path)} bytes of {mime_type}"
+                    )
+                else:
+                    # Prepare the document for Gemini
+                    encoded_doc = self._encode_file(file_path, raw)
+                    
+                    # Create the document part
+                    document_part = {
+                        "mime_type": mime_type,
+                        "data": encoded_doc
+                    }
+                    logger.info(f"Document encoded and prepared for analysis. MIME type: {mime_type}")
+                
+                logger.info("Generating content analysis...")
+                response = self.llm.generate(
+                    contents=[prompt, document_part],
+                    config="analysis"
+                )
+                logger.info("Content analysis completed")
+                summary = response.text
+                store_analysis(cache_key, content_hash, ANALYSIS_PROMPT_VERSION, self.llm.model_name, summary)
+            
+            if existing is not None:
+                # Same bytes analyzed under an older prompt or model: refresh the row in place
+                with metrics.span("db_commit", "document"), Session() as session:
+                    session.add(existing)
+                    existing.summary = summary
+                    existing.content = text
+                    session.commit()
+                logger.info(f"Updated analysis of existing content: {existing.title}")
+                get_chunk_index().index_content(existing)
+                store_fingerprint(existing.id, text)
+                existing.already_ingested = True
+                return existing
             
             # Store in database
-            session = Session()
             filename = os.path.basename(file_path)
             content = Content(
                 type=Path(file_path).suffix[1:],  # File extension without dot
                 source_url=file_path,
                 title=filename,
-                content=prompt,
-                summary=response.text,
-                key_points=None
+                content=text,  # Extracted document text; None for files without a text layer
+                summary=summary,
+                key_points=None,
+                content_hash=content_hash,
+                duplicate_of=duplicate_of
             )
-            session.add(content)
-            session.commit()
+            with metrics.span("db_commit", "document"), Session() as session:
+                session.add(content)
+                session.commit()
             logger.info(f"Content saved to database with title: {filename}")
+            get_chunk_index().index_content(content)
+            store_fingerprint(content.id, text)
             
             return content
             
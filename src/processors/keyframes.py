@@ -0,0 +1,94 @@
+import os
+import logging
+import cv2
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# How often the video is sampled when looking for scene changes
+KEYFRAME_SAMPLE_SECONDS = float(os.getenv('KEYFRAME_SAMPLE_SECONDS', 1.0))
+# Bhattacharyya distance between colour histograms above which a sample starts a new scene
+SCENE_CHANGE_THRESHOLD = float(os.getenv('SCENE_CHANGE_THRESHOLD', 0.3))
+# Frames whose 64-bit difference hashes differ in fewer bits than this are near-identical
+DUPLICATE_HASH_DISTANCE = int(os.getenv('DUPLICATE_HASH_DISTANCE', 6))
+MAX_KEYFRAMES = int(os.getenv('MAX_KEYFRAMES', 40))
+KEYFRAME_WIDTH = int(os.getenv('KEYFRAME_WIDTH', 640))
+KEYFRAME_JPEG_QUALITY = int(os.getenv('KEYFRAME_JPEG_QUALITY', 70))
+
+def _histogram(frame):
+    """Normalized hue/saturation histogram used to detect scene changes."""
+    hsv = cv2.cvtColor(cv2.resize(frame, (160, 90)), cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [32, 32], [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+def _difference_hash(frame):
+    """64-bit difference hash: compares neighbouring pixels of a 9x8 grayscale thumbnail."""
+    gray = cv2.cvtColor(cv2.resize(frame, (9, 8), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+    return sum(1 << i for i, bit in enumerate(bits) if bit)
+
+def _hamming(a, b):
+    return bin(a ^ b).count('1')
+
+def _encode_jpeg(frame):
+    height, width = frame.shape[:2]
+    if width > KEYFRAME_WIDTH:
+        frame = cv2.resize(frame, (KEYFRAME_WIDTH, int(height * KEYFRAME_WIDTH / width)), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, KEYFRAME_JPEG_QUALITY])
+    if not ok:
+        raise ValueError("Failed to encode keyframe")
+    return buffer.tobytes()
+
+def extract_keyframes(video_path, max_frames=MAX_KEYFRAMES):
+    """Sample scene-change keyframes from a video.
+
+    The video is sampled every KEYFRAME_SAMPLE_SECONDS; a sample is kept when its
+    colour histogram differs enough from the last kept frame and it is not a
+    near-duplicate of any kept frame (e.g. a slide shown again later).
+
+    Returns:
+        list: (timestamp in seconds, JPEG bytes) tuples in playback order
+    """
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video: {video_path}")
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25
+        step = max(1, int(round(fps * KEYFRAME_SAMPLE_SECONDS)))
+
+        kept = []  # (timestamp, JPEG bytes); frames are encoded right away to keep memory small
+        hashes = []
+        last_histogram = None
+        index = 0
+        while True:
+            # grab() skips the frame conversion and copy; only sampled frames are retrieved
+            if not capture.grab():
+                break
+            if index % step == 0:
+                ok, frame = capture.retrieve()
+                if ok:
+                    histogram = _histogram(frame)
+                    changed = last_histogram is None or cv2.compareHist(
+                        last_histogram, histogram, cv2.HISTCMP_BHATTACHARYYA
+                    ) > SCENE_CHANGE_THRESHOLD
+                    if changed:
+                        frame_hash = _difference_hash(frame)
+                        if all(_hamming(frame_hash, h) >= DUPLICATE_HASH_DISTANCE for h in hashes):
+                            kept.append((index / fps, _encode_jpeg(frame)))
+                            hashes.append(frame_hash)
+                        last_histogram = histogram
+            index += 1
+    finally:
+        capture.release()
+
+    keyframes = kept
+    if len(keyframes) > max_frames:
+        # Keep an evenly spread subset so the whole video stays covered
+        keyframes = [keyframes[i * len(keyframes) // max_frames] for i in range(max_frames)]
+
+    logger.info(
+        f"Extracted {len(keyframes)} keyframes from {index} frames "
+        f"({sum(len(data) for _, data in keyframes) / 1024:.0f}KB of JPEG)"
+    )
+    return keyframes
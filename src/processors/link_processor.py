@@ -1,13 +1,40 @@
 import os
-import tempfile
 import requests
 from bs4 import BeautifulSoup
+from dotenv import load_dotenv
 from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from .document_processor import DocumentProcessor
+from .crawler import crawl, parse_sitemap, is_sitemap_url, CRAWL_WORKERS, MAX_CRAWL_PAGES
+from ..services.map_reduce import SUMMARY_WORKERS
+from ..services.http_cache import conditional_headers, check_response, response_validators, record_validators
+from ..services import metrics
+from .text_extraction import normalize_text
 import logging
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+try:
+    from lxml import html as lxml_html
+except ImportError:  # lxml is optional
+    lxml_html = None
+
+load_dotenv()
+# Page text extractor: bs4 (default) or lxml (faster; needs `pip install lxml`)
+HTML_EXTRACTOR = os.getenv('HTML_EXTRACTOR', 'bs4')
+if HTML_EXTRACTOR == 'lxml' and lxml_html is None:
+    logging.warning("HTML_EXTRACTOR=lxml but lxml is not installed; using BeautifulSoup")
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+UNWANTED_TAGS = ['script', 'style', 'noscript', 'template', 'nav', 'footer', 'iframe', 'meta', 'link']
+MAIN_CONTENT_SELECTORS = ['main', 'article', 'div[role="main"]', '.main-content', '#main-content']
+# The same selectors for lxml
+MAIN_CONTENT_XPATHS = [
+    '//main', '//article', '//div[@role="main"]',
+    '//*[contains(concat(" ", normalize-space(@class), " "), " main-content ")]', '//*[@id="main-content"]'
+]
+
 class LinkProcessor:
     def __init__(self):
         self.document_processor = DocumentProcessor()
@@ -18,95 +45,223 @@ class LinkProcessor:
             backoff_factor=0.5,
             status_forcelist=[500, 502, 503, 504]
         )
-        self.session.mount('http://', HTTPAdapter(max_retries=retries))
-        self.session.mount('https://', HTTPAdapter(max_retries=retries))
+        # Enough pooled connections for every crawl worker
+        adapter = HTTPAdapter(max_retries=retries, pool_connections=CRAWL_WORKERS, pool_maxsize=CRAWL_WORKERS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def fetch(self, url, revalidate=False):
+        """Download a page and check it against the HTTP cache.
+
+        Returns:
+            tuple: (response, whether the page changed since its validators were
+            last recorded). With revalidate=True the request is conditional, and
+            an unchanged page may come back as a bodiless 304.
+        """
+        parsed_url = urlparse(url)
+        if not parsed_url.scheme or not parsed_url.netloc:
+            raise ValueError("Invalid URL format. Please include http:// or https://")
+        headers = {'User-Agent': USER_AGENT}
+        if revalidate:
+            headers.update(conditional_headers(url))
+        try:
+            with metrics.span("download", "website") as sizes:
+                response = self.session.get(
+                    url,
+                    timeout=(5, 30),  # (connect timeout, read timeout)
+                    headers=headers
+                )
+                response.raise_for_status()
+                sizes["bytes"] = len(response.content)
+            return response, check_response(url, response)
+        except requests.Timeout:
+            raise Exception("Website took too long to respond. Please try again later.")
+        except requests.RequestException as e:
+            raise Exception(f"Error accessing website: {str(e)}")
+
+    def extract_page(self, html_content, url):
+        """Pull the title and main-content text out of a page in a single parse.
+
+        Returns:
+            tuple: (title, page text headed by the title)
+        """
+        with metrics.span("parse", "website") as sizes:
+            sizes["bytes"] = len(html_content)
+            if HTML_EXTRACTOR == 'lxml' and lxml_html is not None:
+                title, text = self._extract_with_lxml(html_content, url)
+            else:
+                title, text = self._extract_with_bs4(html_content, url)
+        return title, f"# {title}\n\n{text}"
+
+    def _extract_with_bs4(self, html_content, url):
+        soup = BeautifulSoup(html_content, 'html.parser')
+        
+        # Get the title early
+        title = soup.title.string if soup.title and soup.title.string else url
+        title = title.strip()
+        
+        # Remove unwanted elements
+        for element in soup.find_all(UNWANTED_TAGS):
+            element.decompose()
+
+        # Try to find main content
+        main_content = None
+        for selector in MAIN_CONTENT_SELECTORS:
+            main_content = soup.select_one(selector)
+            if main_content:
+                break
+
+        if not main_content:
+            # Fallback to body if no main content found
+            main_content = soup.find('body')
+            if not main_content:
+                main_content = soup
+
+        return title, normalize_text(main_content.get_text('\n'), collapse_spaces=True)
+
+    def _extract_with_lxml(self, html_content, url):
+        if isinstance(html_content, str):
+            html_content = html_content.encode('utf-8')
+        tree = lxml_html.document_fromstring(html_content, parser=lxml_html.HTMLParser(encoding='utf-8'))
+        title = (tree.findtext('.//title') or '').strip() or url
+        for element in tree.xpath(' | '.join(f'//{tag}' for tag in UNWANTED_TAGS)):
+            element.drop_tree()
+        main_content = None
+        for selector in MAIN_CONTENT_XPATHS:
+            matches = tree.xpath(selector)
+            if matches:
+                main_content = matches[0]
+                break
+        if main_content is None:
+            main_content = tree.find('body')
+            if main_content is None:
+                main_content = tree
+        return title, normalize_text('\n'.join(main_content.itertext()), collapse_spaces=True)
+
+    def analyze(self, title, page_text, dedup=True):
+        """Analyze a page's extracted text with the DocumentProcessor, in memory."""
+        # The name only sets the type and placeholder title; the caller sets the real title
+        return self.document_processor.process_document(f"{title[:100].replace('/', '-')}.html", text=page_text, dedup=dedup)
 
     def process_link(self, url):
         """
         Process a website link:
         1. Fetch the HTML content
         2. Clean and parse it
-        3. Save to temporary HTML file
-        4. Process using DocumentProcessor
+        3. Process it using DocumentProcessor
         
         Returns:
             tuple: (content_object, title, url) or (None, None, None) if processing fails
         """
-        temp_path = None
+        response, _ = self.fetch(url)
         try:
-            # Validate URL
-            parsed_url = urlparse(url)
-            if not parsed_url.scheme or not parsed_url.netloc:
-                raise ValueError("Invalid URL format. Please include http:// or https://")
-
-            # Fetch content with timeout
-            response = self.session.get(
-                url,
-                timeout=(5, 30),  # (connect timeout, read timeout)
-                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-            )
-            response.raise_for_status()
-            html_content = response.text
-
-            # Parse and clean HTML
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            # Get the title early
-            title = soup.title.string if soup.title else url
-            
-            # Remove unwanted elements
-            for element in soup.find_all(['script', 'style', 'nav', 'footer', 'iframe', 'meta', 'link']):
-                element.decompose()
-
-            # Try to find main content
-            main_content = None
-            for selector in ['main', 'article', 'div[role="main"]', '.main-content', '#main-content']:
-                main_content = soup.select_one(selector)
-                if main_content:
-                    break
-
-            if not main_content:
-                # Fallback to body if no main content found
-                main_content = soup.find('body')
-                if not main_content:
-                    main_content = soup
-
-            # Clean the content
-            cleaned_html = f"""
-            <html>
-            <head>
-                <title>{title}</title>
-            </head>
-            <body>
-                <h1>{title}</h1>
-                {str(main_content)}
-            </body>
-            </html>
-            """
-
-            # Create temporary HTML file
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8') as temp_file:
-                temp_file.write(cleaned_html)
-                temp_path = temp_file.name
-
-            # Process the HTML file using DocumentProcessor
-            content = self.document_processor.process_document(temp_path)
+            title, page_text = self.extract_page(response.text, url)
+            content = self.analyze(title, page_text)
             if content:
+                record_validators(url, response_validators(response))
                 # Let the caller handle the database operations
                 return content, title, url
             return None, None, None
-
-        except requests.Timeout:
-            raise Exception("Website took too long to respond. Please try again later.")
-        except requests.RequestException as e:
-            raise Exception(f"Error accessing website: {str(e)}")
         except Exception as e:
             logging.error(f"Error processing website content: {str(e)}")
             raise Exception(f"Error processing website content: {str(e)}")
-        finally:
-            # Clean up temporary file
-            if temp_path and os.path.exists(temp_path):
+
+    def expand_sitemaps(self, urls):
+        """Replace sitemap URLs (*.xml) with the pages they list, following sitemap indexes."""
+        pages = []
+        pending = list(urls)
+        seen = set()
+        while pending and len(pages) < MAX_CRAWL_PAGES:
+            url = pending.pop(0)
+            if url in seen:
+                continue
+            seen.add(url)
+            if not is_sitemap_url(url):
+                pages.append(url)
+                continue
+            response, _ = self.fetch(url)
+            page_urls, sitemap_urls = parse_sitemap(response.content)
+            pages.extend(page_urls)
+            pending.extend(sitemap_urls)
+        return pages[:MAX_CRAWL_PAGES]
+
+    def process_links(self, urls, progress_callback=None):
+        """
+        Process many pages (or the pages listed in sitemaps) as a batch:
+        pages are fetched and parsed concurrently, politely per host, and
+        then analyzed in parallel.
+        
+        Returns:
+            tuple: (list of (content_object, title, url), {url: error message}, crawl report)
+        """
+        urls = self.expand_sitemaps(urls)
+        validators = {}
+
+        def fetch_page(url):
+            response, _ = self.fetch(url)
+            validators[url] = response_validators(response)
+            return self.extract_page(response.text, url), len(response.content)
+
+        def fetch_progress(done, total, message):
+            if progress_callback:
+                progress_callback(done, total * 2, message)
+
+        pages, failures, report = crawl(urls, fetch_page, progress_callback=fetch_progress)
+        processed = self._analyze_pages(pages, failures, progress_callback, len(urls))
+        for _, _, url in processed:
+            record_validators(url, validators[url])
+        report["failures"] = len(failures)
+        return processed, failures, report
+
+    def refresh_links(self, urls, progress_callback=None):
+        """
+        Revalidate pages with conditional requests and re-analyze only the ones
+        whose content changed since they were last fetched.
+        
+        Returns:
+            tuple: (list of (content_object, title, url) for changed pages, {url: error message}, crawl report)
+        """
+        validators = {}
+
+        def fetch_if_changed(url):
+            response, changed = self.fetch(url, revalidate=True)
+            if not changed:
+                return None, len(response.content)
+            validators[url] = response_validators(response)
+            return self.extract_page(response.text, url), len(response.content)
+
+        def fetch_progress(done, total, message):
+            if progress_callback:
+                progress_callback(done, total * 2, message)
+
+        pages, failures, report = crawl(urls, fetch_if_changed, progress_callback=fetch_progress)
+        changed = {url: page for url, page in pages.items() if page is not None}
+        logging.info(f"Refresh: {len(changed)} of {len(urls)} pages changed")
+        # A changed page is naturally a near-duplicate of its own previous version
+        processed = self._analyze_pages(changed, failures, progress_callback, len(urls), dedup=False)
+        # Only pages re-analyzed successfully move on to their new version; the
+        # others keep their old validators and are re-analyzed on the next refresh
+        for _, _, url in processed:
+            record_validators(url, validators[url])
+        report["changed"] = len(changed)
+        report["failures"] = len(failures)
+        return processed, failures, report
+
+    def _analyze_pages(self, pages, failures, progress_callback, total, dedup=True):
+        """Analyze extracted pages in parallel; failures are added to the failures dict."""
+        processed = []
+        with ThreadPoolExecutor(max_workers=SUMMARY_WORKERS) as executor:
+            futures = {executor.submit(self.analyze, title, page_text, dedup): (url, title) for url, (title, page_text) in pages.items()}
+            for done, future in enumerate(as_completed(futures), start=1):
+                url, title = futures[future]
                 try:
-                    os.remove(temp_path)
+                    content = future.result()
+                    if not content:
+                        raise Exception("Failed to process website content")
+                    processed.append((content, title, url))
                 except Exception as e:
-                    logging.error(f"Error removing temporary file: {str(e)}")
+                    logging.error(f"Error processing {url}: {str(e)}")
+                    failures[url] = str(e)
+                if progress_callback:
+                    progress_callback(total + done * total // len(pages), total * 2, f"Analyzed {done}/{len(pages)} pages")
+        return processed
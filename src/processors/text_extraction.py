@@ -0,0 +1,106 @@
+import csv
+import io
+import re
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# The parsing libraries (PyPDF2, BeautifulSoup) are imported by the functions that
+# use them, so the app starts without them and each loads with its first document
+
+# A PDF averaging fewer extracted characters per page than this is treated as scanned
+MIN_PDF_CHARS_PER_PAGE = 100
+
+# Extensions whose bytes are already the text we want
+PLAIN_TEXT_EXTENSIONS = ['.py', '.js', '.css', '.txt', '.md', '.markdown', '.csv', '.xml']
+
+def normalize_text(text, collapse_spaces=False):
+    """Normalize line endings and blank lines; optionally collapse runs of spaces (prose only, not code)."""
+    text = text.replace('\r\n', '\n').replace('\r', '\n').replace('\x00', '')
+    lines = [line.rstrip() for line in text.split('\n')]
+    if collapse_spaces:
+        lines = [re.sub(r'[ \t\f\v]+', ' ', line).strip() for line in lines]
+    text = '\n'.join(lines)
+    return re.sub(r'\n{3,}', '\n\n', text).strip()
+
+def _decode(data):
+    """Decode bytes as UTF-8, falling back to Latin-1 so nothing is rejected."""
+    try:
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+def _strip_rtf(text):
+    """Reduce RTF markup to its text content."""
+    text = re.sub(r'\\par[d]?\s?', '\n', text)
+    text = re.sub(r"\\'[0-9a-fA-F]{2}", '', text)
+    text = re.sub(r'\\[a-zA-Z]+-?\d* ?', '', text)
+    return text.replace('{', '').replace('}', '')
+
+def html_to_text(html, parser='html.parser'):
+    """Visible text of an HTML document, one block per line."""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, parser)
+    for element in soup.find_all(['script', 'style', 'noscript', 'template']):
+        element.decompose()
+    return normalize_text(soup.get_text('\n'), collapse_spaces=True)
+
+def extract_pdf_pages(file_path):
+    """Text of each page of a PDF (a path or binary stream), or None if the PDF has no usable text layer."""
+    from PyPDF2 import PdfReader
+    try:
+        pages = [page.extract_text() or '' for page in PdfReader(file_path).pages]
+    except Exception as e:
+        logger.warning(f"Could not extract PDF text: {str(e)}")
+        return None
+    if not pages or sum(len(page.strip()) for page in pages) / len(pages) < MIN_PDF_CHARS_PER_PAGE:
+        logger.info("PDF has no usable text layer")
+        return None
+    return [normalize_text(page, collapse_spaces=True) for page in pages]
+
+def extract_text(file_path, mime_type, data=None):
+    """Extract normalized plain text from a document.
+
+    data, if given, is the document's content (bytes or str) and file_path only
+    its name.
+
+    Returns:
+        str: the document text, or None when the format has no local text path
+        (e.g. scanned PDFs) and the raw file has to be sent instead
+    """
+    ext = Path(file_path).suffix.lower()
+    if mime_type == 'application/pdf':
+        pages = extract_pdf_pages(file_path)
+        return '\n\n'.join(pages) if pages else None
+
+    if isinstance(data, str):
+        text = data
+    elif data is not None:
+        text = _decode(data)
+    else:
+        with open(file_path, 'rb') as file:
+            text = _decode(file.read())
+    if ext in ['.html', '.htm']:
+        return html_to_text(text)
+    if ext == '.rtf':
+        return normalize_text(_strip_rtf(text), collapse_spaces=True)
+    if ext in PLAIN_TEXT_EXTENSIONS:
+        return normalize_text(text)
+    return None
+
+def csv_digest(text, sample_rows=50):
+    """Compact description of a CSV: header, row count and a sample of rows."""
+    rows = list(csv.reader(io.StringIO(text)))
+    if len(rows) <= sample_rows + 1:
+        return text
+    header, body = rows[0], rows[1:]
+    sample = io.StringIO()
+    writer = csv.writer(sample)
+    writer.writerow(header)
+    writer.writerows(body[:sample_rows])
+    return (
+        f"CSV with {len(body)} data rows and {len(header)} columns.\n"
+        f"Columns: {', '.join(header)}\n"
+        f"First {sample_rows} rows:\n{sample.getvalue()}"
+    )
@@ -1,14 +1,21 @@
 import yt_dlp
-import google.generativeai as genai
 from ..models.database import Session, Content
+from ..services.retrieval import get_chunk_index
+from ..services.analysis_cache import make_cache_key, get_cached_analysis, store_analysis
+from ..services.map_reduce import map_parts
+from ..services.dedup import check_duplicate, store_fingerprint
+from ..services.llm_client import get_llm_client
+from ..services import metrics
+from .keyframes import extract_keyframes
 import os
 from dotenv import load_dotenv
 import tempfile
 import time
-from PIL import Image
 import base64
-import streamlit as st
 import logging
+import json
+import re
+import hashlib
 
 # Configure logging
 logging.basicConfig(
@@ -19,19 +26,96 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 load_dotenv()
-GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
-genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+
+# Caption languages to look for, in order of preference
+TRANSCRIPT_LANGUAGES = [lang.strip() for lang in os.getenv('TRANSCRIPT_LANGUAGES', 'en').split(',') if lang.strip()]
+# Transcripts longer than this are analyzed in parts and merged (roughly 30-40 minutes of speech)
+TRANSCRIPT_PART_CHARS = int(os.getenv('TRANSCRIPT_PART_CHARS', 40000))
+
+# Videos without captions are analyzed from scene-change keyframes ("keyframes")
+# or uploaded whole, audio included, if they are under 20MB ("video")
+VIDEO_ANALYSIS_MODE = os.getenv('VIDEO_ANALYSIS_MODE', 'keyframes')
+MAX_VIDEO_MB = int(os.getenv('MAX_VIDEO_MB', 500))
+
+# Bump whenever the video analysis prompts change so cached analyses are not reused
+VIDEO_PROMPT_VERSION = "1"
+
+def _format_timestamp(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def _parse_vtt_time(value):
+    hours, minutes, seconds = ([0] + value.split(':'))[-3:]
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def parse_json3_captions(data):
+    """Parse YouTube json3 captions into (start seconds, text) segments."""
+    segments = []
+    for event in json.loads(data).get('events', []):
+        text = ''.join(seg.get('utf8', '') for seg in event.get('segs') or []).strip()
+        if text:
+            segments.append((event.get('tStartMs', 0) / 1000, text))
+    return segments
+
+def parse_vtt_captions(data):
+    """Parse WebVTT captions into (start seconds, text) segments.
+
+    Auto-generated captions repeat the previous line as the next one scrolls in,
+    so lines already seen in the previous cue are dropped.
+    """
+    segments = []
+    previous_lines = set()
+    for block in re.split(r'\n\s*\n', data.replace('\r\n', '\n')):
+        lines = block.strip().split('\n')
+        timing = next((i for i, line in enumerate(lines) if '-->' in line), None)
+        if timing is None:
+            continue
+        start = _parse_vtt_time(lines[timing].split('-->')[0].strip())
+        cue_lines = [re.sub(r'<[^>]+>', '', line).strip() for line in lines[timing + 1:]]
+        cue_lines = [line for line in cue_lines if line]
+        new_lines = [line for line in cue_lines if line not in previous_lines]
+        previous_lines = set(cue_lines)
+        if new_lines:
+            segments.append((start, ' '.join(new_lines)))
+    return segments
+
+def format_transcript(segments, interval=30):
+    """Join caption segments into timestamped paragraphs of about `interval` seconds."""
+    paragraphs = []
+    current = []
+    current_start = None
+    for start, text in segments:
+        if current_start is None:
+            current_start = start
+        elif start - current_start >= interval:
+            paragraphs.append(f"[{_format_timestamp(current_start)}] {' '.join(current)}")
+            current, current_start = [], start
+        current.append(text)
+    if current:
+        paragraphs.append(f"[{_format_timestamp(current_start)}] {' '.join(current)}")
+    return '\n'.join(paragraphs)
 
 class YouTubeProcessor:
     def __init__(self):
-        self.model = genai.GenerativeModel(GEMINI_MODEL)
-        self.ydl_opts = {
-            'format': 'best[ext=mp4]',  # Best quality MP4
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,
-            'max_filesize': 20 * 1024 * 1024  # 20MB limit to be safe
-        }
+        self.llm = get_llm_client()
+        if VIDEO_ANALYSIS_MODE == 'keyframes':
+            # Only sampled frames are sent, so the file size no longer bounds the request;
+            # a modest resolution is plenty for reading slides and diagrams
+            self.ydl_opts = {
+                'format': 'best[ext=mp4][height<=720]/best[ext=mp4]',
+                'quiet': True,
+                'no_warnings': True,
+                'extract_flat': False,
+                'max_filesize': MAX_VIDEO_MB * 1024 * 1024
+            }
+        else:
+            self.ydl_opts = {
+                'format': 'best[ext=mp4]',  # Best quality MP4
+                'quiet': True,
+                'no_warnings': True,
+                'extract_flat': False,
+                'max_filesize': 20 * 1024 * 1024  # 20MB limit to be safe
+            }
 
     def _download_video(self, url, temp_dir):
         """Download video and return path and title."""
@@ -39,83 +123,192 @@ class YouTubeProcessor:
         video_path = os.path.join(temp_dir, 'video.mp4')
         self.ydl_opts['outtmpl'] = video_path
         
-        with st.spinner("Downloading video..."):
-            try:
+        try:
+            with metrics.span("download", "video") as sizes:
                 with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
                     logger.info("Extracting video info...")
                     info = ydl.extract_info(url, download=True)
                     title = info.get('title', 'Untitled Video')
                     logger.info(f"Downloaded video: {title}")
-                    
+                        
                 if not os.path.exists(video_path):
                     raise Exception("Failed to download video")
+                sizes["bytes"] = os.path.getsize(video_path)
                 
-                file_size = os.path.getsize(video_path) / (1024 * 1024)  # Size in MB
-                logger.info(f"Video file size: {file_size:.2f}MB")
+            file_size = sizes["bytes"] / (1024 * 1024)  # Size in MB
+            logger.info(f"Video file size: {file_size:.2f}MB")
                     
-                return video_path, title
-            except Exception as e:
-                logger.error(f"Error downloading video: {str(e)}")
-                raise
+            return video_path, title
+        except Exception as e:
+            logger.error(f"Error downloading video: {str(e)}")
+            raise
 
     def _process_video_data(self, video_path):
         """Process video data and return base64 encoded data."""
         logger.info("Starting video data processing")
         try:
-            with st.spinner("Processing video data..."):
-                start_time = time.time()
-                with open(video_path, 'rb') as f:
-                    video_data = f.read()
-                    encoded_data = base64.b64encode(video_data).decode('utf-8')
-                    processing_time = time.time() - start_time
-                    logger.info(f"Video data processed in {processing_time:.2f} seconds")
-                    return encoded_data
+            start_time = time.time()
+            with metrics.span("encode", "video") as sizes, open(video_path, 'rb') as f:
+                video_data = f.read()
+                sizes["bytes"] = len(video_data)
+                encoded_data = base64.b64encode(video_data).decode('utf-8')
+                processing_time = time.time() - start_time
+                logger.info(f"Video data processed in {processing_time:.2f} seconds")
+                return encoded_data
         except Exception as e:
             logger.error(f"Error processing video data: {str(e)}")
             raise
 
-    def _generate_content(self, prompt, video_part):
-        """Generate content from the model."""
+    def _pick_caption_track(self, info):
+        """Choose the best caption track: manual subtitles before auto captions, preferred languages first."""
+        for captions in [info.get('subtitles') or {}, info.get('automatic_captions') or {}]:
+            languages = [lang for lang in captions if lang != 'live_chat']
+            if not languages:
+                continue
+            candidates = [lang for pref in TRANSCRIPT_LANGUAGES for lang in languages
+                          if lang == pref or lang.startswith(pref + '-')]
+            if info.get('language') in languages:
+                candidates.append(info['language'])
+            lang = candidates[0] if candidates else languages[0]
+            formats = {track.get('ext'): track for track in captions[lang] if track.get('url')}
+            for ext in ['json3', 'vtt']:
+                if ext in formats:
+                    return lang, formats[ext]
+        return None, None
+
+    def _fetch_transcript(self, url):
+        """Get the video title and its timestamped transcript without downloading the video.
+
+        Returns:
+            tuple: (title, transcript) where transcript is None if the video has no captions
+        """
+        logger.info(f"Looking for captions: {url}")
+        opts = {'quiet': True, 'no_warnings': True, 'skip_download': True}
+        with metrics.span("download", "transcript") as sizes, yt_dlp.YoutubeDL(opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+            title = info.get('title', 'Untitled Video')
+            lang, track = self._pick_caption_track(info)
+            if track is None:
+                logger.info("No captions available")
+                return title, None
+            data = ydl.urlopen(track['url']).read().decode('utf-8')
+            sizes["bytes"] = len(data)
+
+        with metrics.span("parse", "transcript") as sizes:
+            sizes["bytes"] = len(data)
+            if track['ext'] == 'json3':
+                segments = parse_json3_captions(data)
+            else:
+                segments = parse_vtt_captions(data)
+            transcript = format_transcript(segments)
+        logger.info(f"Fetched {lang} captions ({track['ext']}): {len(segments)} segments, {len(transcript)} characters")
+        return title, transcript or None
+
+    def _split_transcript(self, transcript, transcript_hash):
+        """Split a long transcript into parts of whole timestamped paragraphs."""
+        parts = []
+        current = []
+        length = 0
+        for paragraph in transcript.split('\n'):
+            if current and length + len(paragraph) > TRANSCRIPT_PART_CHARS:
+                parts.append(current)
+                current, length = [], 0
+            current.append(paragraph)
+            length += len(paragraph) + 1
+        if current:
+            parts.append(current)
+
+        result = []
+        for paragraphs in parts:
+            label = f"{paragraphs[0][1:9]}-{paragraphs[-1][1:9]}"
+            result.append({
+                "label": label,
+                "content_hash": transcript_hash,
+                "cache_key": make_cache_key(f"{transcript_hash}:{label}", VIDEO_PROMPT_VERSION, self.llm.model_name),
+                "payload": (label, '\n'.join(paragraphs))
+            })
+        return result
+
+    def _summarize_transcript_part(self, payload):
+        """Map step: study notes for one stretch of a long transcript."""
+        label, text = payload
+        prompt = f"""You are a helpful study assistant. This is the transcript of {label} of a long lecture video.
+Write detailed study notes for this stretch: concepts explained, definitions, examples, formulas and demonstrations,
+with their timestamps. These notes will be combined with notes on the rest of the lecture later, so do not write
+an introduction or conclusion for the whole video."""
+        response = self.llm.generate(
+            contents=[prompt, text],
+            config="section"
+        )
+        return response.text
+
+    def _analyze_transcript(self, prompt, transcript, progress_callback=None):
+        """Analyze a transcript, map-reducing transcripts too long for a single request."""
+        transcript_hash = hashlib.sha256(transcript.encode('utf-8')).hexdigest()
+        cache_key = make_cache_key(transcript_hash, VIDEO_PROMPT_VERSION, self.llm.model_name)
+        summary = get_cached_analysis(cache_key)
+        if summary is not None:
+            return summary
+
+        if len(transcript) <= TRANSCRIPT_PART_CHARS:
+            summary = self._generate_content(prompt, f"TRANSCRIPT:\n{transcript}")
+        else:
+            parts = self._split_transcript(transcript, transcript_hash)
+            logger.info(f"Long transcript: analyzing {len(parts)} parts")
+            partials = map_parts(
+                parts, self._summarize_transcript_part, VIDEO_PROMPT_VERSION, self.llm.model_name,
+                progress_callback=progress_callback
+            )
+            notes = "\n\n".join(f"## Notes on {part['label']}\n{partial}" for part, partial in zip(parts, partials))
+            summary = self._generate_content(
+                f"{prompt}\nThe lecture is long, so its transcript was read in parts. "
+                "Base your breakdown on these notes, which cover the whole video:",
+                notes,
+                max_output_tokens=min(8192, 1024 + 512 * len(parts))
+            )
+        store_analysis(cache_key, transcript_hash, VIDEO_PROMPT_VERSION, self.llm.model_name, summary)
+        return summary
+
+    def _process_keyframes(self, video_path):
+        """Sample scene-change keyframes and turn them into timestamped image parts."""
+        logger.info("Starting keyframe extraction")
+        with metrics.span("encode", "keyframes") as sizes:
+            start_time = time.time()
+            keyframes = extract_keyframes(video_path)
+            logger.info(f"Keyframes extracted in {time.time() - start_time:.2f} seconds")
+            parts = []
+            for timestamp, jpeg in keyframes:
+                parts.append(f"Frame at [{_format_timestamp(timestamp)}]:")
+                parts.append({'mime_type': 'image/jpeg', 'data': base64.b64encode(jpeg).decode('utf-8')})
+            sizes["bytes"] = sum(len(jpeg) for _, jpeg in keyframes)
+        return parts
+
+    def _generate_content(self, prompt, video_part, max_output_tokens=None):
+        """Generate content from the model. video_part may be a single part or a list of parts."""
         logger.info("Starting content generation")
         try:
-            with st.spinner("Analyzing video content..."):
-                start_time = time.time()
-                response = self.model.generate_content(
-                    contents=[prompt, video_part],
-                    generation_config={
-                        "temperature": 0.7,
-                        "top_k": 40,
-                        "top_p": 0.8,
-                        "max_output_tokens": 1024,
-                    }
-                )
-                processing_time = time.time() - start_time
-                logger.info(f"Content generated in {processing_time:.2f} seconds")
-                return response.text
+            start_time = time.time()
+            parts = video_part if isinstance(video_part, list) else [video_part]
+            response = self.llm.generate(
+                contents=[prompt, *parts],
+                config="video",
+                max_output_tokens=max_output_tokens
+            )
+            processing_time = time.time() - start_time
+            logger.info(f"Content generated in {processing_time:.2f} seconds")
+            return response.text
         except Exception as e:
             logger.error(f"Error generating content: {str(e)}")
             raise
 
-    def process_video(self, url):
-        """Process a YouTube video and store its content."""
-        temp_dir = tempfile.mkdtemp()
-        try:
-            # Download video and get title
-            video_path, title = self._download_video(url, temp_dir)
-            
-            # Process video content
-            content = Content(
-                title=title,
-                source_type="youtube"  # Set source type here
-            )
-            
-            # Generate summary and key points
-            video_base64 = self._process_video_data(video_path)
-            video_part = {
-                'mime_type': 'video/mp4',
-                'data': video_base64
-            }
-            prompt = f"""Analyze this educational video and provide a comprehensive educational breakdown:
+    def _build_prompt(self, title, source="video"):
+        """The video analysis prompt for a source of "video", "transcript" or "keyframes"."""
+        subject = {
+            "video": "this educational video",
+            "transcript": "this educational video from its timestamped transcript",
+            "keyframes": "this educational video from keyframes sampled at its scene changes (there is no audio)"
+        }[source]
+        return f"""Analyze {subject} and provide a comprehensive educational breakdown:
 
 1. Detailed Content Breakdown:
    - Core concepts explained (with timestamps if available)
@@ -158,15 +351,54 @@ Note: Focus on extracting educational value. Include specific examples, explanat
 Video Title: {title}
 
 """
-            summary = self._generate_content(prompt, video_part)
+
+    def process_video(self, url, progress_callback=None):
+        """Process a YouTube video and store its content.
+        
+        The video's captions are analyzed when it has any; the video itself is only
+        downloaded and sent to the model when there are none.
+        """
+        temp_dir = tempfile.mkdtemp()
+        try:
+            title, transcript = self._fetch_transcript(url)
+            content = Content(
+                title=title,
+                source_url=url,
+                source_type="youtube"  # Set source type here
+            )
+            
+            if transcript:
+                # Re-uploads of a video already in the library
+                duplicate, content.duplicate_of = check_duplicate(transcript)
+                if duplicate is not None:
+                    logger.info(f"Near-duplicate of '{duplicate.title}', skipping analysis")
+                    duplicate.already_ingested = True
+                    return duplicate
+                summary = self._analyze_transcript(self._build_prompt(title, source="transcript"), transcript, progress_callback)
+                content.content = f"YouTube Video: {url}\n\nTranscript:\n{transcript}"
+            else:
+                # No captions: fall back to analyzing the video itself
+                video_path, title = self._download_video(url, temp_dir)
+                if VIDEO_ANALYSIS_MODE == 'keyframes':
+                    frame_parts = self._process_keyframes(video_path)
+                    summary = self._generate_content(self._build_prompt(title, source="keyframes"), frame_parts)
+                else:
+                    video_base64 = self._process_video_data(video_path)
+                    video_part = {
+                        'mime_type': 'video/mp4',
+                        'data': video_base64
+                    }
+                    summary = self._generate_content(self._build_prompt(title), video_part)
+                content.content = f"YouTube Video: {url}\n\nSummary:\n{summary}"
             content.summary = summary
-            content.content = f"YouTube Video: {url}\n\nSummary:\n{summary}"
             
             # Store in database
-            session = Session()
-            session.add(content)
-            session.commit()
+            with metrics.span("db_commit", "youtube"), Session() as session:
+                session.add(content)
+                session.commit()
             logger.info("Content saved to database")
+            get_chunk_index().index_content(content)
+            store_fingerprint(content.id, content.content)
             
             return content
             
@@ -0,0 +1,48 @@
+import hashlib
+import logging
+from ..models.database import Session, AnalysisCache
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+def hash_file(file_path, block_size=1024 * 1024):
+    """SHA-256 of a file, read in blocks so large uploads are not loaded at once."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def hash_bytes(data):
+    """SHA-256 of in-memory content."""
+    return hashlib.sha256(data).hexdigest()
+
+def make_cache_key(content_hash, prompt_version, model):
+    """Cache key for one analysis: the same bytes analyzed with the same prompt and model."""
+    return hashlib.sha256(f"{content_hash}:{prompt_version}:{model}".encode('utf-8')).hexdigest()
+
+def get_cached_analysis(cache_key):
+    """Return the stored analysis text for a key, or None."""
+    with Session() as session:
+        entry = session.get(AnalysisCache, cache_key)
+        if entry is None:
+            metrics.increment("analysis_cache_misses")
+            return None
+        entry.hits = (entry.hits or 0) + 1
+        session.commit()
+        metrics.increment("analysis_cache_hits")
+        logger.info(f"Analysis cache hit for {entry.content_hash[:12]}")
+        return entry.summary
+
+def store_analysis(cache_key, content_hash, prompt_version, model, summary):
+    """Remember an analysis so identical content is never sent to the model twice."""
+    with Session() as session:
+        session.merge(AnalysisCache(
+            cache_key=cache_key,
+            content_hash=content_hash,
+            prompt_version=prompt_version,
+            model=model,
+            summary=summary,
+            hits=0
+        ))
+        session.commit()
@@ -0,0 +1,112 @@
+import os
+import re
+import math
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from ..models.database import Session, UserQuery
+from . import metrics
+from .retrieval import tokenize
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+ANSWER_CACHE_TTL_HOURS = float(os.getenv('ANSWER_CACHE_TTL_HOURS', 24))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 1000))
+# Cosine similarity of character trigrams above which two questions count as the
+# same question. 1.0 (the default) only reuses answers to questions that are the
+# same after normalization; lower values opt in to fuzzy matching, which also
+# requires both questions to contain exactly the same numbers
+ANSWER_SIMILARITY_THRESHOLD = float(os.getenv('ANSWER_SIMILARITY_THRESHOLD', 1.0))
+
+def normalize_question(question):
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return " ".join(re.findall(r'\w+', question.lower()))
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def similarity(a, b):
+    """Cosine similarity of the character trigram vectors of two normalized questions."""
+    va, vb = _trigrams(a), _trigrams(b)
+    dot = sum(count * vb[gram] for gram, count in va.items())
+    norm = math.sqrt(sum(c * c for c in va.values())) * math.sqrt(sum(c * c for c in vb.values()))
+    return dot / norm if norm else 0.0
+
+def _numbers(question):
+    return {term for term in tokenize(question) if any(c.isdigit() for c in term)}
+
+def same_numbers(a, b):
+    """Whether two normalized questions contain the same numbers.
+
+    Trigram similarity rates "explain chapter 3" and "explain chapter 4" as
+    near-identical, so numbers must match exactly; the trigram score decides
+    how much the rest of the wording may differ.
+    """
+    return _numbers(a) == _numbers(b)
+
+def get_cached_answer(question, style, library_version, model):
+    """Return a stored answer to the same (or a near-identical) question, or None."""
+    normalized = normalize_question(question)
+    if not normalized:
+        return None
+    cutoff = datetime.utcnow() - timedelta(hours=ANSWER_CACHE_TTL_HOURS)
+    with Session() as session:
+        candidates = session.query(UserQuery).filter(
+            UserQuery.style == style,
+            UserQuery.library_version == library_version,
+            UserQuery.model == model,
+            UserQuery.created_at >= cutoff,
+        )
+        entry = candidates.filter(UserQuery.normalized_query == normalized).first()
+        score = 1.0
+        if entry is None and ANSWER_SIMILARITY_THRESHOLD < 1.0:
+            best = max(
+                (
+                    (similarity(normalized, row.normalized_query), row) for row in candidates.all()
+                    if same_numbers(normalized, row.normalized_query)
+                ),
+                key=lambda pair: pair[0],
+                default=(0.0, None)
+            )
+            if best[0] >= ANSWER_SIMILARITY_THRESHOLD:
+                score, entry = best
+        if entry is None:
+            metrics.increment("answer_cache_misses")
+            return None
+        entry.hits = (entry.hits or 0) + 1
+        entry.last_used_at = datetime.utcnow()
+        session.commit()
+        metrics.increment("answer_cache_hits")
+        logger.info(f"Answer cache hit (similarity {score:.2f}): {entry.query[:60]}")
+        return entry.response
+
+def store_answer(question, style, library_version, model, response):
+    """Remember an answer, evicting expired and least recently used entries."""
+    normalized = normalize_question(question)
+    if not normalized:
+        return
+    now = datetime.utcnow()
+    with Session() as session:
+        session.add(UserQuery(
+            query=question,
+            response=response,
+            normalized_query=normalized,
+            style=style,
+            library_version=library_version,
+            model=model,
+            hits=0,
+            created_at=now,
+            last_used_at=now
+        ))
+        session.query(UserQuery).filter(
+            UserQuery.created_at < now - timedelta(hours=ANSWER_CACHE_TTL_HOURS)
+        ).delete(synchronize_session=False)
+        session.flush()
+        excess = session.query(UserQuery).count() - ANSWER_CACHE_MAX_ENTRIES
+        if excess > 0:
+            oldest = session.query(UserQuery.id).order_by(UserQuery.last_used_at).limit(excess)
+            session.query(UserQuery).filter(UserQuery.id.in_(oldest.scalar_subquery())).delete(synchronize_session=False)
+        session.commit()
@@ -0,0 +1,228 @@
+import os
+import time
+import queue
+import logging
+import itertools
+import threading
+from dotenv import load_dotenv
+from . import metrics
+from .llm_client import get_llm_client, response_text
+from .model_scheduler import ModelBusyError, DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# A chat answer that hasn't started within this many seconds (including the wait
+# for a model request slot) is given up on (0 = no deadline)
+CHAT_DEADLINE_SECONDS = float(os.getenv('CHAT_DEADLINE_SECONDS', 60))
+# Hedging: if the answer hasn't started after the HEDGE_PERCENTILE time to first
+# token of the learning style, the same request is sent again and the first of
+# the two to answer is used. Until HEDGE_MIN_SAMPLES answers have been timed,
+# HEDGE_DELAY_SECONDS is used instead.
+CHAT_HEDGING = os.getenv('CHAT_HEDGING', 'off') == 'on'
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 95))
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', 20))
+HEDGE_DELAY_SECONDS = float(os.getenv('HEDGE_DELAY_SECONDS', 5))
+
+def history_from_messages(messages):
+    """Convert Streamlit chat messages into Gemini chat history."""
+    history = []
+    for message in messages:
+        role = "model" if message["role"] == "assistant" else "user"
+        # Gemini expects the conversation to open with a user turn, so skip the greeting
+        if not history and role == "model":
+            continue
+        history.append({"role": role, "parts": [message["content"]]})
+    return history
+
+class ChatEngine:
+    """A chat conversation with a fixed system instruction.
+
+    The instructions are sent as the model's system instruction instead of an
+    extra chat message, so every question costs exactly one model round-trip.
+    Per-question study material is attached to that one request but kept out of
+    the stored history, so it is not re-uploaded on later turns.
+    """
+
+    def __init__(self, system_instruction, history=None, llm=None, style="general"):
+        self.system_instruction = system_instruction
+        self.llm = llm or get_llm_client()
+        self.style = style
+        self.history = list(history or [])
+        self.round_trips = 0
+        self.last_round_trips = 0
+        self.last_complete = True
+
+    def _request_contents(self, message, context):
+        """History plus the new user turn, with study material prepended if any."""
+        if context:
+            message = f"{context}\n\nQUESTION: {message}"
+        return self.history + [{"role": "user", "parts": [message]}]
+
+    def remember(self, message, answer):
+        """Add an exchange answered without the model (e.g. from a cache) to the history."""
+        self.history.append({"role": "user", "parts": [message]})
+        self.history.append({"role": "model", "parts": [answer]})
+        self.last_round_trips = 0
+        self.last_complete = True
+
+    def _hedge_delay(self, stream):
+        name = "chat_time_to_first_token_seconds" if stream else "chat_latency_seconds"
+        delay = metrics.get_quantile(f"{name}_{self.style}", HEDGE_PERCENTILE / 100, min_samples=HEDGE_MIN_SAMPLES)
+        return HEDGE_DELAY_SECONDS if delay is None else delay
+
+    def _start(self, contents, stream, deadline):
+        """One request; a stream is read up to its first chunk. Runs on a worker thread."""
+        response = self.llm.generate(
+            contents, config="chat", system_instruction=self.system_instruction, stream=stream, deadline=deadline
+        )
+        if not stream:
+            return response
+        chunks = iter(response)
+        return next(chunks, None), chunks
+
+    def _first_response(self, contents, stream=False, deadline=None):
+        """Send a request, hedged with a second copy if enabled; returns (response, requests sent).
+
+        For a stream the response is (first chunk, iterator of the other chunks).
+        Raises DeadlineExceeded if nothing arrived before deadline.
+        """
+        results = queue.Queue()
+        lock = threading.Lock()
+        winner = None
+
+        def discard(response):
+            if stream:
+                response[1].close()  # Ends the losing stream and frees its scheduler slot
+
+        def run(attempt):
+            try:
+                item = (attempt, self._start(contents, stream, deadline), None)
+            except Exception as e:
+                item = (attempt, None, e)
+            with lock:
+                if winner is None:
+                    results.put(item)
+                elif item[1] is not None:
+                    discard(item[1])
+
+        def launch(attempt):
+            threading.Thread(target=run, args=(attempt,), name=f"chat-request-{attempt}", daemon=True).start()
+
+        launch(0)
+        launched, failed = 1, 0
+        hedge_at = time.monotonic() + self._hedge_delay(stream) if CHAT_HEDGING else None
+        while True:
+            now = time.monotonic()
+            waits = [t - now for t in (deadline, hedge_at if launched == 1 else None) if t is not None]
+            try:
+                attempt, response, error = results.get(timeout=max(0, min(waits)) if waits else None)
+            except queue.Empty:
+                if deadline is not None and time.monotonic() >= deadline:
+                    with lock:
+                        winner = -1
+                        while not results.empty():
+                            _, late, _ = results.get()
+                            if late is not None:
+                                discard(late)
+                    metrics.increment("chat_deadline_exceeded")
+                    raise DeadlineExceeded(f"No answer within {CHAT_DEADLINE_SECONDS:g}s")
+                if launched == 1 and time.monotonic() >= hedge_at:
+                    logger.info(f"No answer after {self._hedge_delay(stream):.2f}s, sending a hedged request")
+                    metrics.increment("chat_hedged_requests")
+                    launch(1)
+                    launched = 2
+                continue
+            if error is not None:
+                failed += 1
+                if failed == launched:
+                    raise error
+                continue
+            with lock:
+                winner = attempt
+                while not results.empty():
+                    _, late, _ = results.get()
+                    if late is not None:
+                        discard(late)
+            if attempt == 1:
+                metrics.increment("chat_hedge_wins")
+            return response, launched
+
+    def _deadline(self):
+        return time.monotonic() + CHAT_DEADLINE_SECONDS if CHAT_DEADLINE_SECONDS else None
+
+    def _record(self, message, answer, round_trips, complete=True):
+        self.history.append({"role": "user", "parts": [message]})
+        self.history.append({"role": "model", "parts": [answer]})
+        self.last_complete = complete
+        self.round_trips += round_trips
+        self.last_round_trips = round_trips
+        metrics.increment("chat_questions")
+        metrics.increment("chat_round_trips", round_trips)
+        metrics.observe("chat_round_trips_per_question", round_trips)
+
+    def _log_latency(self, first_token, total):
+        logger.info(f"Chat latency ({self.style}): first token {first_token:.2f}s, total {total:.2f}s")
+        for suffix in ("", f"_{self.style}"):
+            metrics.observe(f"chat_time_to_first_token_seconds{suffix}", first_token)
+            metrics.observe(f"chat_latency_seconds{suffix}", total)
+
+    def send(self, message, context=None):
+        """Answer a question in a single model call (two if hedged) and return the response text."""
+        start_time = time.time()
+        response, round_trips = self._first_response(self._request_contents(message, context), deadline=self._deadline())
+        answer = response.text
+        total = time.time() - start_time
+        # Without streaming the first token arrives together with the whole answer
+        self._log_latency(total, total)
+        self._record(message, answer, round_trips)
+        return answer
+
+    def stream(self, message, context=None):
+        """Answer a question, yielding text chunks as the model produces them.
+
+        If the stream fails before anything arrived, the answer is fetched with a
+        regular call instead; if it fails partway, the partial answer is kept and
+        a short notice is appended. Raises DeadlineExceeded if the answer doesn't
+        start in time.
+        """
+        contents = self._request_contents(message, context)
+        deadline = self._deadline()
+        start_time = time.time()
+        first_token = None
+        round_trips = 1
+        complete = True
+        parts = []
+        try:
+            (first, chunks), round_trips = self._first_response(contents, stream=True, deadline=deadline)
+            for chunk in itertools.chain([first] if first is not None else [], chunks):
+                # A stream's last chunk may have no text parts even when the answer finished normally
+                text = response_text(chunk)
+                if not text:
+                    continue
+                if first_token is None:
+                    first_token = time.time() - start_time
+                parts.append(text)
+                yield text
+        except Exception as e:
+            if parts:
+                logger.warning(f"Response stream interrupted after {len(parts)} chunks: {str(e)}")
+                metrics.increment("chat_stream_interrupted")
+                complete = False
+                yield "\n\n_(The response was interrupted. Ask again to get the rest of the answer.)_"
+            elif isinstance(e, (ModelBusyError, DeadlineExceeded)):
+                # Already retried or out of time; a regular call would not do better
+                raise
+            else:
+                logger.warning(f"Response stream failed, falling back to a regular call: {str(e)}")
+                metrics.increment("chat_stream_fallbacks")
+                round_trips += 1
+                response, _ = self._first_response(contents, deadline=deadline)
+                answer = response.text
+                first_token = time.time() - start_time
+                parts.append(answer)
+                yield answer
+
+        total = time.time() - start_time
+        self._log_latency(first_token if first_token is not None else total, total)
+        self._record(message, "".join(parts), round_trips, complete)
@@ -0,0 +1,82 @@
+import os
+import logging
+import threading
+from dotenv import load_dotenv
+from ..models.database import Session, Content, get_library_version
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Sources listed by name in the system instruction; the rest are only counted
+CATALOG_MAX_SOURCES = int(os.getenv('CATALOG_MAX_SOURCES', 100))
+
+def format_catalog(sources, max_sources=CATALOG_MAX_SOURCES):
+    """List the sources in the library for the system instruction, newest first."""
+    lines = [f"- {source['title']} ({source['type']})" for source in sources[:max_sources]]
+    if len(sources) > max_sources:
+        lines.append(f"- ...and {len(sources) - max_sources} more")
+    return "\n".join(lines)
+
+class ContextCache:
+    """Process-wide cache of the library listing and the prompts rendered from it.
+
+    Every Streamlit session shares one instance. Entries are tied to the library
+    version kept by database triggers, so adding or deleting a source anywhere
+    (another session, an ingestion worker) invalidates them without any code
+    having to remember to reset the cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._sources = []
+        self._blocks = {}
+
+    def _current(self):
+        version = get_library_version()
+        with self._lock:
+            if version == self._version:
+                return version
+        # Built outside the lock so readers of the current version aren't held up;
+        # concurrent rebuilds of the same version produce identical results
+        with Session() as session:
+            rows = session.query(Content.title, Content.type).order_by(Content.created_at.desc(), Content.id.desc()).all()
+        sources = [{"title": row.title, "type": row.type if row.type else "document"} for row in rows]
+        with self._lock:
+            # A slower rebuild of an older version must not replace a newer one
+            if self._version is not None and self._version > version:
+                return self._version
+            self._version = version
+            self._sources = sources
+            self._blocks = {}
+        metrics.increment("context_cache_rebuilds")
+        logger.info(f"Context cache rebuilt for library version {version} ({len(sources)} sources)")
+        return version
+
+    def get_sources(self):
+        """Return (library version, list of source dicts with title and type)."""
+        self._current()
+        with self._lock:
+            return self._version, self._sources
+
+    def get_prompt_block(self, key, render):
+        """Return (library version, render(sources)), rendering once per key and version."""
+        self._current()
+        with self._lock:
+            version, sources = self._version, self._sources
+            block = self._blocks.get(key)
+        if block is None:
+            block = render(sources)
+            with self._lock:
+                if self._version == version:
+                    self._blocks[key] = block
+        else:
+            metrics.increment("context_cache_hits")
+        return version, block
+
+_cache = ContextCache()
+
+def get_context_cache():
+    """Context cache shared by every Streamlit session."""
+    return _cache
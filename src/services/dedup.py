@@ -0,0 +1,133 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+import numpy as np
+from collections import Counter
+from dotenv import load_dotenv
+from sqlalchemy import or_
+from ..models.database import Session, Content, ContentFingerprint
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# What to do with a near-duplicate of a source already in the library:
+# merge (reuse the existing source, no model call), flag (analyze it but mark it), or off
+DEDUP_MODE = os.getenv('DEDUP_MODE', 'merge')
+# SimHashes differing in at most this many of their 64 bits are near-duplicates
+DEDUP_MAX_DISTANCE = int(os.getenv('DEDUP_MAX_DISTANCE', 3))
+# Shorter texts don't have enough shingles for a meaningful fingerprint
+DEDUP_MIN_WORDS = int(os.getenv('DEDUP_MIN_WORDS', 100))
+
+SHINGLE_WORDS = 3
+# The 64-bit hash is stored split into bands. Two hashes differing in at most
+# BAND_COUNT - 1 bits agree exactly on at least one band (pigeonhole principle),
+# so candidates are found with indexed equality lookups instead of a scan.
+# A DEDUP_MAX_DISTANCE above BAND_COUNT - 1 may miss some near-duplicates.
+BAND_COUNT = 4
+BAND_BITS = 64 // BAND_COUNT
+
+def simhash(text):
+    """64-bit SimHash of a text over its word 3-shingles, or None if the text is too short."""
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < max(DEDUP_MIN_WORDS, SHINGLE_WORDS):
+        return None
+    shingles = Counter(' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1))
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big') for shingle in shingles],
+        dtype=np.uint64
+    )
+    counts = np.array(list(shingles.values()), dtype=np.int64)
+    # Each shingle votes +count for the bits set in its hash and -count for the others
+    bits = (hashes[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    weights = ((bits.astype(np.int64) * 2 - 1) * counts[:, None]).sum(axis=0)
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+def _bands(fingerprint):
+    mask = (1 << BAND_BITS) - 1
+    return [fingerprint >> (i * BAND_BITS) & mask for i in range(BAND_COUNT)]
+
+def _to_signed(value):
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def _hamming(a, b):
+    return bin(a ^ b).count('1')
+
+_backfill_lock = threading.Lock()
+_backfilled = False
+
+def _backfill():
+    """Fingerprint sources stored before fingerprints existed (once per process)."""
+    global _backfilled
+    with _backfill_lock:
+        if _backfilled:
+            return
+        with Session() as session:
+            fingerprinted = session.query(ContentFingerprint.content_id)
+            rows = session.query(Content.id, Content.content).filter(
+                ~Content.id.in_(fingerprinted), Content.content.isnot(None)
+            ).all()
+        added = sum(1 for row in rows if store_fingerprint(row.id, row.content))
+        if added:
+            logger.info(f"Fingerprinted {added} existing sources")
+        _backfilled = True
+
+def find_near_duplicate(text, exclude_id=None):
+    """The source whose text is a near-duplicate of this text, as (content, distance), or None."""
+    if DEDUP_MODE == 'off':
+        return None
+    fingerprint = simhash(text)
+    if fingerprint is None:
+        return None
+    _backfill()
+    bands = _bands(fingerprint)
+    with Session() as session:
+        candidates = session.query(ContentFingerprint).filter(
+            or_(*(getattr(ContentFingerprint, f'band{i}') == band for i, band in enumerate(bands)))
+        ).all()
+        best = None
+        for candidate in candidates:
+            if candidate.content_id == exclude_id:
+                continue
+            distance = _hamming(fingerprint, candidate.simhash % (1 << 64))
+            if distance <= DEDUP_MAX_DISTANCE and (best is None or distance < best[1]):
+                best = (candidate.content_id, distance)
+        content = session.get(Content, best[0]) if best else None
+    metrics.increment("dedup_checks")
+    if content is None:
+        return None
+    metrics.increment("dedup_near_duplicates")
+    logger.info(f"Near-duplicate of '{content.title}' (SimHash distance {best[1]})")
+    return content, best[1]
+
+def store_fingerprint(content_id, text):
+    """Fingerprint a stored source's text; returns False if the text is too short."""
+    fingerprint = simhash(text or '')
+    if fingerprint is None:
+        return False
+    bands = _bands(fingerprint)
+    with Session() as session:
+        session.merge(ContentFingerprint(
+            content_id=content_id,
+            simhash=_to_signed(fingerprint),
+            **{f'band{i}': band for i, band in enumerate(bands)}
+        ))
+        session.commit()
+    return True
+
+def check_duplicate(text):
+    """Apply DEDUP_MODE to a source about to be analyzed.
+
+    Returns:
+        tuple: (existing source to use instead of analyzing this one, or None;
+        id of the source to flag this one as a duplicate of, or None)
+    """
+    match = find_near_duplicate(text) if text else None
+    if match is None:
+        return None, None
+    if DEDUP_MODE == 'merge':
+        return match[0], None
+    return None, match[0].id
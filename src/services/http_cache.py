@@ -0,0 +1,59 @@
+import hashlib
+from datetime import datetime
+from ..models.database import Session, HttpCacheEntry
+from . import metrics
+
+def conditional_headers(url):
+    """If-None-Match / If-Modified-Since headers for a page fetched before."""
+    with Session() as session:
+        entry = session.get(HttpCacheEntry, url)
+    headers = {}
+    if entry is not None:
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+    return headers
+
+def check_response(url, response):
+    """Whether the page changed since its validators were last recorded.
+
+    A 304 Not Modified or a body identical to the recorded one both count as
+    unchanged. Nothing but the time of the check is saved: the new validators
+    are recorded with record_validators() once the page has been analyzed, so
+    a page whose re-analysis fails is still seen as changed next time.
+    """
+    with Session() as session:
+        entry = session.get(HttpCacheEntry, url)
+        if response.status_code == 304:
+            metrics.increment("http_cache_not_modified")
+            if entry is not None:
+                entry.checked_at = datetime.utcnow()
+                session.commit()
+            return False
+        changed = entry is None or entry.body_hash != hashlib.sha256(response.content).hexdigest()
+    metrics.increment("http_cache_changed" if changed else "http_cache_unchanged_body")
+    return changed
+
+def response_validators(response):
+    """What record_validators() needs from a full (200) response."""
+    return {
+        "etag": response.headers.get('ETag'),
+        "last_modified": response.headers.get('Last-Modified'),
+        "body_hash": hashlib.sha256(response.content).hexdigest(),
+    }
+
+def record_validators(url, validators):
+    """Remember the validators of the page version that is now stored."""
+    now = datetime.utcnow()
+    with Session() as session:
+        entry = session.get(HttpCacheEntry, url)
+        if entry is None:
+            entry = HttpCacheEntry(url=url)
+            session.add(entry)
+        entry.etag = validators["etag"]
+        entry.last_modified = validators["last_modified"]
+        entry.body_hash = validators["body_hash"]
+        entry.fetched_at = now
+        entry.checked_at = now
+        session.commit()
@@ -0,0 +1,134 @@
+import os
+import shutil
+import uuid
+import logging
+from ..models.database import Session, Content
+from ..processors.document_processor import DocumentProcessor
+from . import metrics
+from .retrieval import get_chunk_index
+
+logger = logging.getLogger(__name__)
+
+# The YouTube (yt_dlp, OpenCV, PIL) and website (requests, BeautifulSoup) processors
+# are imported by their ingesters, so their libraries load with the first such source
+
+# Uploaded files wait here until their ingestion job has run
+UPLOAD_DIR = os.path.join('database', 'uploads')
+
+def stage_upload(filename, data):
+    """Save an uploaded file where a background job can pick it up; returns its path."""
+    upload_dir = os.path.join(UPLOAD_DIR, uuid.uuid4().hex)
+    os.makedirs(upload_dir, exist_ok=True)
+    path = os.path.join(upload_dir, os.path.basename(filename))
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+def ingest_document(file_path, progress_callback=None):
+    """Analyze a staged document and store it; the staged copy is removed afterwards."""
+    try:
+        content = DocumentProcessor().process_document(file_path, progress_callback=progress_callback)
+        if not content:
+            raise Exception("Failed to process document")
+        return content
+    finally:
+        if os.path.dirname(os.path.abspath(file_path)).startswith(os.path.abspath(UPLOAD_DIR)):
+            shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+
+def ingest_youtube(url, progress_callback=None):
+    """Analyze a YouTube video and store it."""
+    from ..processors.youtube_processor import YouTubeProcessor
+    content = YouTubeProcessor().process_video(url, progress_callback=progress_callback)
+    if not content:
+        raise Exception("Failed to process video")
+    return content
+
+def ingest_website(url, progress_callback=None):
+    """Analyze a web page and store it as a website source."""
+    from ..processors.link_processor import LinkProcessor
+    if progress_callback:
+        progress_callback(0, 2, "Fetching website content...")
+    content, title, url = LinkProcessor().process_link(url)
+    if not (content and title and url):
+        raise Exception("Failed to process website content. The content might be too complex or not accessible.")
+    if progress_callback:
+        progress_callback(1, 2, "Saving processed content...")
+    return _save_website(content, title, url)
+
+def ingest_websites(urls, progress_callback=None):
+    """Crawl a batch of pages (newline-separated URLs and/or sitemap.xml URLs) and store each one."""
+    from ..processors.link_processor import LinkProcessor
+    urls = [url.strip() for url in urls.splitlines() if url.strip()]
+    processed, failures, report = LinkProcessor().process_links(urls, progress_callback=progress_callback)
+    metrics.increment("crawl_pages", report["pages"])
+    metrics.increment("crawl_failures", report["failures"])
+    metrics.increment("crawl_bytes", report["bytes"])
+    metrics.observe("crawl_pages_per_second", report["pages_per_second"])
+    if not processed:
+        raise Exception(f"Failed to process any of the {len(failures)} pages")
+    return [_save_website(content, title, url) for content, title, url in processed]
+
+def refresh_websites(_source=None, progress_callback=None):
+    """Revalidate every website source and re-analyze only the pages that changed.
+
+    A changed page is analyzed into a new source that replaces the old one.
+    """
+    from ..processors.link_processor import LinkProcessor
+    with Session() as session:
+        rows = session.query(Content.id, Content.source_url).filter(
+            Content.source_type == "website", Content.source_url.isnot(None)
+        ).all()
+    ids_by_url = {}
+    for row in rows:
+        ids_by_url.setdefault(row.source_url, []).append(row.id)
+    if not ids_by_url:
+        return []
+
+    changed, failures, report = LinkProcessor().refresh_links(list(ids_by_url), progress_callback=progress_callback)
+    metrics.increment("refresh_pages_checked", len(ids_by_url))
+    metrics.increment("refresh_pages_changed", report["changed"])
+    logger.info(
+        f"Refreshed {len(ids_by_url)} websites: {report['changed']} changed, "
+        f"{len(changed)} re-analyzed, {len(failures)} failed"
+    )
+
+    refreshed = []
+    for content, title, url in changed:
+        content = _save_website(content, title, url)
+        stale = [content_id for content_id in ids_by_url[url] if content_id != content.id]
+        if stale:
+            with Session() as session:
+                session.query(Content).filter(Content.id.in_(stale)).delete(synchronize_session=False)
+                session.commit()
+            for content_id in stale:
+                get_chunk_index().remove_content(content_id)
+        refreshed.append(content)
+    return refreshed
+
+def _save_website(content, title, url):
+    """Label a newly analyzed page as a website source.
+
+    A page whose text is already in the library (the same body under another URL,
+    a mirror, or an upload) comes back as that existing source, which is left untouched.
+    """
+    if content.already_ingested:
+        logger.info(f"{url} is already in the library as source {content.id} ('{content.title}')")
+        metrics.increment("website_already_ingested")
+        return content
+    with metrics.span("db_commit", "website"), Session() as session:
+        content.title = title
+        content.source_type = "website"
+        content.source_url = url
+        content = session.merge(content)
+        session.commit()
+        session.refresh(content)
+        session.expunge(content)
+    return content
+
+INGESTERS = {
+    "document": ingest_document,
+    "youtube": ingest_youtube,
+    "website": ingest_website,
+    "websites": ingest_websites,
+    "refresh": refresh_websites,
+}
@@ -0,0 +1,189 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from sqlalchemy import or_
+from ..models.database import Session, IngestionJob
+from . import metrics
+from .ingestion import INGESTERS
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', 3))
+# A queue renews the lease on its active jobs every third of this; a job whose lease
+# is older belongs to a process that stopped, and another queue may take it over
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', 60))
+
+# Progress is written to the database at most this often per job
+PROGRESS_INTERVAL = 0.5
+
+ACTIVE_STATES = ('queued', 'running')
+
+def _lease_expired():
+    """Filter for jobs no running queue holds a lease on."""
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_LEASE_SECONDS)
+    return or_(IngestionJob.worker_id.is_(None), IngestionJob.heartbeat_at.is_(None), IngestionJob.heartbeat_at < cutoff)
+
+class JobQueue:
+    """Persistent ingestion job queue with a worker pool.
+
+    Jobs are rows in the ingestion_jobs table, so the sidebar of every session
+    can show their state and progress. Each queue (the app's, or a CLI run's)
+    holds a lease on the active jobs it works on; jobs whose lease has expired
+    were left unfinished by a process that stopped and are taken over by the
+    next queue that recovers jobs, never while their owner is still running.
+    """
+
+    def __init__(self, handlers, max_workers=INGESTION_WORKERS, recover=True):
+        self.handlers = handlers
+        self.recover = recover
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ingest')
+        if recover:
+            self.resume()
+        threading.Thread(target=self._keep_leases, name='ingest-leases', daemon=True).start()
+
+    def resume(self, job_ids=None):
+        """Take over and run active jobs whose lease has expired (all of them by default).
+
+        Returns the ids of the jobs taken over; jobs another running queue holds are left to it.
+        """
+        with Session() as session:
+            query = session.query(IngestionJob.id).filter(IngestionJob.state.in_(ACTIVE_STATES), _lease_expired())
+            if job_ids is not None:
+                query = query.filter(IngestionJob.id.in_(job_ids))
+            candidates = [job_id for (job_id,) in query.all()]
+        job_ids = [job_id for job_id in candidates if self._claim(job_id)]
+        for job_id in job_ids:
+            self._executor.submit(self._run, job_id)
+        if job_ids:
+            logger.info(f"Resumed {len(job_ids)} unfinished ingestion jobs")
+        return job_ids
+
+    def _claim(self, job_id):
+        """Take a job's lease if it is still expired; False if another queue took it first."""
+        with Session() as session:
+            claimed = session.query(IngestionJob).filter(
+                IngestionJob.id == job_id, IngestionJob.state.in_(ACTIVE_STATES), _lease_expired()
+            ).update({
+                "worker_id": self.worker_id, "heartbeat_at": datetime.utcnow(),
+                "state": 'queued', "message": 'Resuming after restart'
+            }, synchronize_session=False)
+            session.commit()
+        return claimed == 1
+
+    def _keep_leases(self):
+        """Renew the lease on this queue's active jobs, and take over abandoned jobs if it recovers them."""
+        while True:
+            time.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                with Session() as session:
+                    session.query(IngestionJob).filter(
+                        IngestionJob.worker_id == self.worker_id, IngestionJob.state.in_(ACTIVE_STATES)
+                    ).update({"heartbeat_at": datetime.utcnow()}, synchronize_session=False)
+                    session.commit()
+                if self.recover:
+                    self.resume()
+            except Exception as e:
+                logger.warning(f"Could not renew ingestion job leases: {str(e)}")
+
+    def release_leases(self):
+        """Give up this queue's active jobs so another queue can take them over at once (e.g. on exit)."""
+        with Session() as session:
+            session.query(IngestionJob).filter(
+                IngestionJob.worker_id == self.worker_id, IngestionJob.state.in_(ACTIVE_STATES)
+            ).update({"worker_id": None}, synchronize_session=False)
+            session.commit()
+
+    def submit(self, kind, source, title=None):
+        """Queue a source for ingestion and return the job id."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        with Session() as session:
+            job = IngestionJob(
+                kind=kind, source=source, title=title or source, state='queued', progress=0.0, message='Queued',
+                worker_id=self.worker_id, heartbeat_at=datetime.utcnow()
+            )
+            session.add(job)
+            session.commit()
+            job_id = job.id
+        metrics.increment("ingestion_jobs_submitted")
+        self._executor.submit(self._run, job_id)
+        logger.info(f"Queued {kind} job {job_id}: {source}")
+        return job_id
+
+    def _update(self, job_id, **fields):
+        with Session() as session:
+            session.query(IngestionJob).filter(IngestionJob.id == job_id).update(fields)
+            session.commit()
+
+    def _run(self, job_id):
+        with Session() as session:
+            job = session.get(IngestionJob, job_id)
+            # Skip jobs that finished, or that another queue took over after this one's lease lapsed
+            if job is None or job.state not in ACTIVE_STATES or job.worker_id != self.worker_id:
+                return
+            kind, source = job.kind, job.source
+        self._update(job_id, state='running', message='Starting...')
+        start_time = time.time()
+        last_update = [0.0]
+
+        def report_progress(done, total, message):
+            now = time.time()
+            if now - last_update[0] >= PROGRESS_INTERVAL or done >= total:
+                last_update[0] = now
+                self._update(job_id, progress=done / total if total else 0.0, message=message)
+
+        try:
+            content = self.handlers[kind](source, progress_callback=report_progress)
+            if isinstance(content, list):
+                # Batch jobs (e.g. a crawl) store any number of sources
+                self._update(
+                    job_id, state='done', progress=1.0, message=f'Done ({len(content)} sources)',
+                    content_id=content[0].id if content else None
+                )
+            else:
+                message = f"Already in the library as '{content.title}'" if content.already_ingested else 'Done'
+                self._update(job_id, state='done', progress=1.0, message=message, content_id=content.id)
+            metrics.increment("ingestion_jobs_done")
+            metrics.observe(f"ingestion_{kind}_seconds", time.time() - start_time)
+            logger.info(f"Ingestion job {job_id} done in {time.time() - start_time:.2f} seconds")
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {str(e)}")
+            metrics.increment("ingestion_jobs_failed")
+            self._update(job_id, state='failed', message='Failed', error=str(e))
+
+    def recent_jobs(self, limit=5):
+        """All active jobs plus the most recent finished ones, newest first."""
+        with Session() as session:
+            active = session.query(IngestionJob).filter(
+                IngestionJob.state.in_(ACTIVE_STATES)
+            ).order_by(IngestionJob.id.desc()).all()
+            finished = session.query(IngestionJob).filter(
+                ~IngestionJob.state.in_(ACTIVE_STATES)
+            ).order_by(IngestionJob.id.desc()).limit(limit).all()
+            session.expunge_all()
+            return active + finished
+
+    def clear_finished(self):
+        """Remove finished and failed jobs from the list."""
+        with Session() as session:
+            session.query(IngestionJob).filter(~IngestionJob.state.in_(ACTIVE_STATES)).delete()
+            session.commit()
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """Process-wide job queue shared by every Streamlit session."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(INGESTERS)
+        return _queue
@@ -0,0 +1,40 @@
+import os
+from dotenv import load_dotenv
+from sqlalchemy import func
+from sqlalchemy.orm import load_only
+from ..models.database import Session, Content
+
+load_dotenv()
+SOURCES_PAGE_SIZE = int(os.getenv('SOURCES_PAGE_SIZE', 20))
+
+# Columns needed to list a source; the large text columns are loaded on demand
+LISTING_COLUMNS = (Content.id, Content.title, Content.type, Content.source_type, Content.duplicate_of, Content.created_at)
+
+def count_sources():
+    with Session() as session:
+        return session.query(func.count(Content.id)).scalar()
+
+def list_sources(offset=0, limit=SOURCES_PAGE_SIZE):
+    """One page of sources, newest first, without their text columns."""
+    with Session() as session:
+        return (
+            session.query(Content)
+            .options(load_only(*LISTING_COLUMNS))
+            .order_by(Content.created_at.desc(), Content.id.desc())
+            .offset(offset)
+            .limit(limit)
+            .all()
+        )
+
+def get_sources(source_ids):
+    """Sources by id without their text columns, in the order of source_ids."""
+    with Session() as session:
+        sources = session.query(Content).options(load_only(*LISTING_COLUMNS)).filter(Content.id.in_(source_ids)).all()
+    by_id = {source.id: source for source in sources}
+    return [by_id[source_id] for source_id in source_ids if source_id in by_id]
+
+def get_source_details(source_id):
+    """Summary and key points of one source, or None if it no longer exists."""
+    with Session() as session:
+        row = session.query(Content.summary, Content.key_points).filter(Content.id == source_id).first()
+        return {"summary": row.summary, "key_points": row.key_points} if row else None
@@ -0,0 +1,258 @@
+import os
+import time
+import random
+import hashlib
+import logging
+import threading
+import itertools
+from dotenv import load_dotenv
+from . import metrics
+from .retrieval import estimate_tokens
+from .model_scheduler import get_model_scheduler, remaining_seconds, DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
+# gemini, or fake for a deterministic offline model (development and benchmarks)
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')
+# Timeout of a whole streamed request (0 = none). A stream's deadline only bounds
+# the wait for its first chunk, so it is not used as the request timeout
+MODEL_STREAM_TIMEOUT_SECONDS = float(os.getenv('MODEL_STREAM_TIMEOUT_SECONDS', 600))
+# Fake backend behaviour: time to the first token, then output speed and length
+FAKE_LLM_LATENCY_SECONDS = float(os.getenv('FAKE_LLM_LATENCY_SECONDS', 0.5))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv('FAKE_LLM_TOKENS_PER_SECOND', 200))
+FAKE_LLM_OUTPUT_TOKENS = int(os.getenv('FAKE_LLM_OUTPUT_TOKENS', 300))
+# Share of fake requests that fail with a quota error (429), to exercise retries
+FAKE_LLM_ERROR_RATE = float(os.getenv('FAKE_LLM_ERROR_RATE', 0))
+
+# Vocabulary of the fake backend's answers
+FAKE_WORDS = (
+    "study concept example definition method result model data theory proof "
+    "lecture chapter summary question answer review practice key point idea"
+).split()
+
+_SAMPLING = {"temperature": 0.7, "top_k": 40, "top_p": 0.8}
+
+# Generation settings per kind of request
+GENERATION_CONFIGS = {
+    "chat": dict(_SAMPLING, max_output_tokens=1024),
+    "analysis": dict(_SAMPLING, max_output_tokens=2048),  # Analysis of a whole source
+    "section": dict(_SAMPLING, max_output_tokens=1024),  # Notes on one part of a large source
+    "video": dict(_SAMPLING, max_output_tokens=1024),  # Analysis of a video, its keyframes or transcript
+}
+
+class GeminiBackend:
+    """Google Gemini through the google-generativeai SDK.
+
+    The SDK takes about a second to import, so it is loaded with the first
+    backend instead of with the app.
+    """
+
+    _configured = False
+    _configure_lock = threading.Lock()
+
+    def __init__(self, model_name):
+        import google.generativeai as genai
+        self.genai = genai
+        self.model_name = model_name
+        with GeminiBackend._configure_lock:
+            if not GeminiBackend._configured:
+                genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+                GeminiBackend._configured = True
+
+    def generate(self, contents, generation_config, system_instruction=None, stream=False, timeout=None):
+        # Models are cheap local objects; the system instruction is fixed per model
+        model = self.genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
+        request_options = {"timeout": timeout} if timeout else None
+        return model.generate_content(contents, generation_config=generation_config, stream=stream,
+                                      request_options=request_options)
+
+class FakeQuotaError(Exception):
+    """Stands in for Gemini's ResourceExhausted error."""
+
+    code = 429
+
+class FakeResponse:
+    """Stands in for a Gemini response or stream chunk."""
+
+    def __init__(self, text):
+        self.text = text
+
+class FakeBackend:
+    """Deterministic offline model: the same request always gets the same answer.
+
+    Answers take FAKE_LLM_LATENCY_SECONDS to start and then arrive at
+    FAKE_LLM_TOKENS_PER_SECOND, like a real model, but nothing leaves the machine.
+    """
+
+    def __init__(self, model_name="fake", latency=FAKE_LLM_LATENCY_SECONDS,
+                 tokens_per_second=FAKE_LLM_TOKENS_PER_SECOND, output_tokens=FAKE_LLM_OUTPUT_TOKENS,
+                 error_rate=FAKE_LLM_ERROR_RATE):
+        self.model_name = model_name
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+
+    def _answer_words(self, contents, generation_config, system_instruction):
+        digest = hashlib.sha256(repr((system_instruction, contents, generation_config)).encode('utf-8')).hexdigest()
+        count = min(self.output_tokens, generation_config.get("max_output_tokens", self.output_tokens))
+        # One word per token, chosen by a generator seeded with the request
+        return random.Random(digest).choices(FAKE_WORDS, k=count)
+
+    def _stream(self, words, chunk_words=20):
+        time.sleep(self.latency)
+        for start in range(0, len(words), chunk_words):
+            chunk = words[start:start + chunk_words]
+            time.sleep(len(chunk) / self.tokens_per_second)
+            yield FakeResponse(("" if start == 0 else " ") + " ".join(chunk))
+
+    def generate(self, contents, generation_config, system_instruction=None, stream=False, timeout=None):
+        if random.random() < self.error_rate:
+            raise FakeQuotaError("429 Resource has been exhausted (fake)")
+        words = self._answer_words(contents, generation_config, system_instruction)
+        duration = self.latency if stream else self.latency + len(words) / self.tokens_per_second
+        if timeout is not None and duration > timeout:
+            time.sleep(max(0, timeout))
+            raise DeadlineExceeded("504 Deadline exceeded (fake)")
+        if stream:
+            return self._stream(words)
+        time.sleep(duration)
+        return FakeResponse(" ".join(words))
+
+def _payload_bytes(contents):
+    """Size of a request's text and inline data."""
+    if isinstance(contents, str):
+        return len(contents.encode('utf-8'))
+    if isinstance(contents, dict):
+        if "data" in contents:
+            return len(contents["data"])
+        return _payload_bytes(contents.get("parts", []))
+    if isinstance(contents, (list, tuple)):
+        return sum(_payload_bytes(part) for part in contents)
+    return 0
+
+def _prompt_text(contents):
+    """The text parts of a request (inline data has no text to count)."""
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, dict):
+        return "" if "data" in contents else _prompt_text(contents.get("parts", []))
+    if isinstance(contents, (list, tuple)):
+        return "\n".join(_prompt_text(part) for part in contents)
+    return ""
+
+def response_text(response):
+    """Text of a response or stream chunk, or "" if it has none."""
+    # Gemini raises on responses without text (e.g. blocked, or a stream's final chunk)
+    try:
+        return response.text or ""
+    except Exception:
+        return ""
+
+def _count_tokens(sizes, contents, system_instruction, answer, response):
+    """Token counts reported by the model, estimated when it reports none."""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    response_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    sizes["prompt_tokens"] = prompt_tokens or estimate_tokens(_prompt_text(contents)) + estimate_tokens(system_instruction)
+    sizes["response_tokens"] = response_tokens or estimate_tokens(answer)
+
+class LLMClient:
+    """The one way the app calls a language model.
+
+    Chat and every processor go through generate(), so the backend, the model and
+    the generation settings are chosen in one place. Every request waits for its
+    turn in the process-wide model scheduler (rate limit, concurrency cap, priority
+    lanes, retries) and every attempt is recorded as a model_call span with its
+    payload size and token counts.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.model_name = backend.model_name
+
+    def generate(self, contents, config="analysis", system_instruction=None, stream=False, lane=None,
+                 deadline=None, **overrides):
+        """Send a request and return the response (an iterator of chunks when stream is True).
+
+        config names an entry of GENERATION_CONFIGS; keyword arguments other than None
+        override its settings. lane is the scheduler lane; chat requests default to
+        "interactive", everything else to "background". deadline (a time.monotonic()
+        value) bounds the wait for a slot and is passed to the model as a timeout.
+        For a stream it bounds the wait for a slot and the retries only; waiting
+        for the first chunk is the caller's to bound (ChatEngine does), and the
+        whole stream is limited by MODEL_STREAM_TIMEOUT_SECONDS instead.
+        """
+        generation_config = dict(GENERATION_CONFIGS[config])
+        generation_config.update((key, value) for key, value in overrides.items() if value is not None)
+        lane = lane or ("interactive" if config == "chat" else "background")
+        if stream:
+            return self._stream(contents, generation_config, system_instruction, config, lane, deadline)
+
+        def attempt():
+            with metrics.span("model_call", config) as sizes:
+                sizes["bytes"] = _payload_bytes(contents) + _payload_bytes(system_instruction or "")
+                response = self.backend.generate(contents, generation_config, system_instruction=system_instruction,
+                                                 timeout=remaining_seconds(deadline))
+                _count_tokens(sizes, contents, system_instruction, response_text(response), response)
+            return response
+
+        return get_model_scheduler().call(lane, attempt, deadline=deadline)
+
+    def _stream(self, contents, generation_config, system_instruction, config, lane, deadline=None):
+        """Pass the chunks through, holding a scheduler slot until the stream ends.
+
+        A request is retried only until its first chunk arrives; the span covers
+        the stream up to its last chunk.
+        """
+        sizes = {"bytes": _payload_bytes(contents) + _payload_bytes(system_instruction or "")}
+        start = None
+
+        def open_stream():
+            nonlocal start
+            start = time.perf_counter()
+            try:
+                chunks = iter(self.backend.generate(contents, generation_config, system_instruction=system_instruction,
+                                                    stream=True, timeout=MODEL_STREAM_TIMEOUT_SECONDS or None))
+                return chunks, next(chunks, None)
+            except Exception:
+                metrics.record_span("model_call", config, time.perf_counter() - start, sizes, failed=True)
+                raise
+
+        scheduler = get_model_scheduler()
+        chunks, first = scheduler.call(lane, open_stream, hold=True, deadline=deadline)
+        parts, last = [], None
+        failed = False
+        try:
+            for chunk in itertools.chain([first] if first is not None else [], chunks):
+                parts.append(response_text(chunk))
+                last = chunk
+                yield chunk
+        except Exception:
+            failed = True
+            raise
+        finally:
+            scheduler.release()
+            _count_tokens(sizes, contents, system_instruction, "".join(parts), last)
+            metrics.record_span("model_call", config, time.perf_counter() - start, sizes, failed)
+
+def create_backend(name=LLM_BACKEND, model_name=GEMINI_MODEL):
+    if name == 'fake':
+        return FakeBackend()
+    if name == 'gemini':
+        return GeminiBackend(model_name)
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_llm_client():
+    """Process-wide model client."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LLMClient(create_backend())
+            logger.info(f"LLM client: {LLM_BACKEND} backend, model {_client.model_name}")
+        return _client
@@ -0,0 +1,59 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from .analysis_cache import get_cached_analysis, store_analysis
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+SUMMARY_WORKERS = int(os.getenv('SUMMARY_WORKERS', 4))
+
+def map_parts(parts, summarize, prompt_version, model, max_workers=SUMMARY_WORKERS, progress_callback=None):
+    """Summarize the parts of a large source concurrently in a bounded worker pool.
+
+    Each part is a dict with a cache_key, content_hash, label and payload. Every
+    partial summary is stored in the analysis cache as soon as it is done, so an
+    interrupted run resumes from the parts that are still missing.
+
+    Args:
+        parts: parts in source order
+        summarize: callable turning a part's payload into summary text
+        progress_callback: optional callable(done, total, message), called from the caller's thread
+
+    Returns:
+        list: summary text per part, in source order
+    """
+    total = len(parts)
+    results = [None] * total
+    pending = []
+    for position, part in enumerate(parts):
+        cached = get_cached_analysis(part["cache_key"])
+        if cached is None:
+            pending.append(position)
+        else:
+            results[position] = cached
+
+    done = total - len(pending)
+    if done:
+        logger.info(f"Resuming: {done}/{total} parts already summarized")
+    if progress_callback:
+        progress_callback(done, total, f"Summarized {done} of {total} parts")
+
+    def run(position):
+        part = parts[position]
+        summary = summarize(part["payload"])
+        store_analysis(part["cache_key"], part["content_hash"], prompt_version, model, summary)
+        return summary
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(run, position): position for position in pending}
+        for future in as_completed(futures):
+            position = futures[future]
+            results[position] = future.result()
+            done += 1
+            logger.info(f"Summarized part {parts[position]['label']} ({done}/{total})")
+            if progress_callback:
+                progress_callback(done, total, f"Summarized {parts[position]['label']} ({done} of {total})")
+
+    return results
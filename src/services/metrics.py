@@ -0,0 +1,214 @@
+import os
+import re
+import time
+import logging
+import threading
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Serve the metrics in Prometheus text format on this port (0 = off)
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+# Upper bounds (seconds) of the span duration histogram buckets
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Summary quantiles are computed over this many most recent observations
+QUANTILE_WINDOW = int(os.getenv('QUANTILE_WINDOW', 500))
+QUANTILES = (0.5, 0.95, 0.99)
+
+# What a span can record besides its duration
+SPAN_SIZES = ("bytes", "prompt_tokens", "response_tokens")
+
+# Process-wide metrics shared by every Streamlit session and processor
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_observations = {}
+_spans = {}  # (stage, kind) -> aggregated span stats
+
+def increment(name, value=1):
+    """Add to a counter."""
+    with _lock:
+        _counters[name] += value
+
+def set_gauge(name, value):
+    """Set a value that goes up and down (e.g. a queue depth)."""
+    with _lock:
+        _gauges[name] = value
+
+def observe(name, value):
+    """Record one observation (e.g. a latency) for a summary metric."""
+    with _lock:
+        stats = _observations.get(name)
+        if stats is None:
+            stats = _observations[name] = {
+                "count": 0, "sum": 0.0, "min": value, "max": value, "last": value,
+                "recent": deque(maxlen=QUANTILE_WINDOW)
+            }
+        stats["recent"].append(value)
+        stats["count"] += 1
+        stats["sum"] += value
+        stats["min"] = min(stats["min"], value)
+        stats["max"] = max(stats["max"], value)
+        stats["last"] = value
+
+def get_counter(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+def get_gauge(name):
+    with _lock:
+        return _gauges.get(name, 0)
+
+def _quantile(ordered, quantile):
+    return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+def get_quantile(name, quantile, min_samples=1):
+    """Quantile of a summary's recent observations, or None with fewer than min_samples."""
+    with _lock:
+        stats = _observations.get(name)
+        if stats is None or len(stats["recent"]) < min_samples:
+            return None
+        return _quantile(sorted(stats["recent"]), quantile)
+
+def record_span(stage, kind, seconds, sizes=None, failed=False):
+    """Add one finished span to the per-stage aggregates."""
+    with _lock:
+        stats = _spans.get((stage, kind))
+        if stats is None:
+            stats = _spans[(stage, kind)] = {
+                "count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0,
+                "buckets": [0] * (len(SPAN_BUCKETS) + 1),
+                **{size: 0 for size in SPAN_SIZES}
+            }
+        stats["count"] += 1
+        stats["errors"] += 1 if failed else 0
+        stats["seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        stats["buckets"][bisect_left(SPAN_BUCKETS, seconds)] += 1
+        for size, value in (sizes or {}).items():
+            if size in stats:
+                stats[size] += value or 0
+
+@contextmanager
+def span(stage, kind=None):
+    """Time one stage of the hot path: download, parse, encode, model_call, db_commit, ...
+
+    kind says what the stage worked on (e.g. "website" or "chat"). The yielded
+    dict takes the sizes the stage handled, any of SPAN_SIZES:
+
+        with metrics.span("download", "website") as sizes:
+            response = requests.get(url)
+            sizes["bytes"] = len(response.content)
+    """
+    sizes = {}
+    failed = False
+    start = time.perf_counter()
+    try:
+        yield sizes
+    except Exception:
+        failed = True
+        raise
+    finally:
+        record_span(stage, kind, time.perf_counter() - start, sizes, failed)
+
+def span_quantile(stats, quantile):
+    """Upper bound of the histogram bucket holding the given quantile of a span's durations."""
+    rank = quantile * stats["count"]
+    seen = 0
+    for bound, count in zip(SPAN_BUCKETS, stats["buckets"]):
+        seen += count
+        if seen >= rank:
+            return bound
+    return stats["max_seconds"]
+
+def snapshot():
+    """Copy of all counters, gauges, summaries and spans, with averages filled in."""
+    with _lock:
+        summaries = {}
+        for name, stats in _observations.items():
+            ordered = sorted(stats["recent"])
+            summaries[name] = dict(
+                {key: value for key, value in stats.items() if key != "recent"},
+                avg=stats["sum"] / stats["count"],
+                **{f"p{quantile * 100:g}": _quantile(ordered, quantile) for quantile in QUANTILES}
+            )
+        spans = {key: dict(stats, buckets=list(stats["buckets"])) for key, stats in _spans.items()}
+        return {"counters": dict(_counters), "gauges": dict(_gauges), "summaries": summaries, "spans": spans}
+
+def _metric_name(name):
+    return "studymate_" + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+def _labels(stage, kind, **extra):
+    labels = {"stage": stage, **({"kind": kind} if kind else {}), **extra}
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = []
+    for name, value in sorted(data["counters"].items()):
+        metric = _metric_name(name) + "_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value:g}"]
+    for name, value in sorted(data["gauges"].items()):
+        metric = _metric_name(name)
+        lines += [f"# TYPE {metric} gauge", f"{metric} {value:g}"]
+    for name, stats in sorted(data["summaries"].items()):
+        metric = _metric_name(name)
+        lines.append(f"# TYPE {metric} summary")
+        lines += [f'{metric}{{quantile="{quantile:g}"}} {stats[f"p{quantile * 100:g}"]:g}' for quantile in QUANTILES]
+        lines += [f"{metric}_sum {stats['sum']:g}", f"{metric}_count {stats['count']}"]
+
+    spans = sorted(data["spans"].items(), key=lambda item: (item[0][0], item[0][1] or ""))
+    if spans:
+        lines.append("# TYPE studymate_span_seconds histogram")
+    for (stage, kind), stats in spans:
+        cumulative = 0
+        for bound, count in zip(SPAN_BUCKETS + ("+Inf",), stats["buckets"]):
+            cumulative += count
+            lines.append(f"studymate_span_seconds_bucket{_labels(stage, kind, le=bound)} {cumulative}")
+        lines.append(f"studymate_span_seconds_sum{_labels(stage, kind)} {stats['seconds']:g}")
+        lines.append(f"studymate_span_seconds_count{_labels(stage, kind)} {stats['count']}")
+    for field in ("errors",) + SPAN_SIZES:
+        if spans:
+            lines.append(f"# TYPE studymate_span_{field}_total counter")
+        for (stage, kind), stats in spans:
+            lines.append(f"studymate_span_{field}_total{_labels(stage, kind)} {stats[field]}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_server = None
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics on a background thread (once per process); does nothing if port is 0."""
+    global _server
+    with _lock:
+        if _server is not None or not port:
+            return
+        try:
+            _server = ThreadingHTTPServer(('0.0.0.0', port), _MetricsHandler)
+        except OSError as e:
+            logger.warning(f"Metrics endpoint not started on port {port}: {str(e)}")
+            _server = False
+            return
+    threading.Thread(target=_server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Serving metrics on http://localhost:{port}/metrics")
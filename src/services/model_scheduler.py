@@ -0,0 +1,165 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from dotenv import load_dotenv
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Model requests started per minute across all sessions and ingestion workers (0 = no limit),
+# with up to MODEL_BURST requests allowed back to back after a quiet period
+MODEL_REQUESTS_PER_MINUTE = float(os.getenv('MODEL_REQUESTS_PER_MINUTE', 60))
+MODEL_BURST = int(os.getenv('MODEL_BURST', 10))
+# Model requests running at the same time
+MODEL_MAX_IN_FLIGHT = int(os.getenv('MODEL_MAX_IN_FLIGHT', 8))
+# Quota (429) and server (5xx) errors are retried with jittered exponential backoff
+MODEL_MAX_RETRIES = int(os.getenv('MODEL_MAX_RETRIES', 3))
+MODEL_RETRY_BASE_SECONDS = float(os.getenv('MODEL_RETRY_BASE_SECONDS', 1))
+MODEL_RETRY_MAX_SECONDS = float(os.getenv('MODEL_RETRY_MAX_SECONDS', 30))
+
+# Lanes in priority order: chat questions are started before waiting ingestion work
+LANES = ("interactive", "background")
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+class ModelBusyError(Exception):
+    """The model kept answering with quota or server errors after every retry."""
+
+class DeadlineExceeded(TimeoutError):
+    """A model request could not be answered before its deadline."""
+
+def remaining_seconds(deadline):
+    """Seconds left until a time.monotonic() deadline; None for no deadline."""
+    return None if deadline is None else deadline - time.monotonic()
+
+def is_retryable(error):
+    """Quota exhausted (429) or a server error (5xx)."""
+    status = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    try:
+        return int(status) in RETRYABLE_STATUS
+    except (TypeError, ValueError):
+        return False
+
+class ModelScheduler:
+    """Admission control for model requests, shared by the whole process.
+
+    A request starts once it is first in the highest-priority waiting lane, fewer
+    than max_in_flight requests are running and the token bucket has a token.
+    Queue depth, requests in flight and waiting times are published as metrics.
+    """
+
+    def __init__(self, requests_per_minute=MODEL_REQUESTS_PER_MINUTE, burst=MODEL_BURST,
+                 max_in_flight=MODEL_MAX_IN_FLIGHT):
+        self.rate = requests_per_minute / 60.0
+        self.burst = max(1, burst)
+        self.max_in_flight = max(1, max_in_flight)
+        self._condition = threading.Condition()
+        self._queues = {lane: deque() for lane in LANES}
+        self._in_flight = 0
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _next_ticket(self):
+        for lane in LANES:
+            if self._queues[lane]:
+                return self._queues[lane][0]
+        return None
+
+    def _publish(self):
+        for lane, queue in self._queues.items():
+            metrics.set_gauge(f"model_queue_depth_{lane}", len(queue))
+        metrics.set_gauge("model_in_flight", self._in_flight)
+
+    def acquire(self, lane, deadline=None):
+        """Wait for this request's turn; every acquire must be paired with a release().
+
+        Raises DeadlineExceeded if the turn doesn't come before deadline (time.monotonic()).
+        """
+        ticket = object()
+        start = time.monotonic()
+        with self._condition:
+            self._queues[lane].append(ticket)
+            self._publish()
+            while True:
+                timeout = None
+                if self._next_ticket() is ticket and self._in_flight < self.max_in_flight:
+                    if not self.rate:
+                        break
+                    self._refill()
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+                    timeout = (1 - self._tokens) / self.rate
+                remaining = remaining_seconds(deadline)
+                if remaining is not None:
+                    if remaining <= 0:
+                        self._queues[lane].remove(ticket)
+                        self._publish()
+                        self._condition.notify_all()
+                        metrics.increment("model_deadline_exceeded_waiting")
+                        raise DeadlineExceeded("Deadline passed while waiting for a model request slot")
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                self._condition.wait(timeout)
+            self._queues[lane].popleft()
+            self._in_flight += 1
+            self._publish()
+            # The next request in line may be able to start too
+            self._condition.notify_all()
+        metrics.observe(f"model_queue_wait_seconds_{lane}", time.monotonic() - start)
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._publish()
+            self._condition.notify_all()
+
+    def call(self, lane, request, hold=False, deadline=None):
+        """Run request() when admitted, retrying quota and server errors.
+
+        With hold=True the request's slot stays taken after it returns (e.g. while
+        a response stream is read) and the caller must release() it. No retry is
+        started that would begin after deadline.
+        """
+        for attempt in range(MODEL_MAX_RETRIES + 1):
+            self.acquire(lane, deadline)
+            try:
+                result = request()
+            except Exception as e:
+                self.release()
+                if not is_retryable(e):
+                    raise
+                metrics.increment("model_retryable_errors")
+                # Full jitter keeps retries from many sessions from arriving together
+                delay = random.uniform(0, min(MODEL_RETRY_MAX_SECONDS, MODEL_RETRY_BASE_SECONDS * 2 ** attempt))
+                remaining = remaining_seconds(deadline)
+                if remaining is not None and delay >= remaining:
+                    raise DeadlineExceeded(f"No time left to retry the model request: {str(e)}") from e
+                if attempt == MODEL_MAX_RETRIES:
+                    raise ModelBusyError(f"The model is overloaded: {str(e)}") from e
+                logger.warning(f"Model request failed ({str(e)}), retry {attempt + 1} in {delay:.1f}s")
+                metrics.increment("model_retries")
+                time.sleep(delay)
+                continue
+            if not hold:
+                self.release()
+            return result
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_model_scheduler():
+    """Process-wide scheduler for all model requests."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ModelScheduler()
+        return _scheduler
@@ -0,0 +1,108 @@
+import os
+import logging
+from dotenv import load_dotenv
+from .retrieval import estimate_tokens, CONTEXT_TOKEN_BUDGET
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# How the token budget is shared between sources: "fair" gives every source the
+# same share, "relevance" shares it by the sources' retrieval scores
+PACKING_STRATEGY = os.getenv('PACKING_STRATEGY', 'fair')
+# A chunk is only cut short if at least this much of it still fits
+MIN_TRUNCATED_TOKENS = int(os.getenv('MIN_TRUNCATED_TOKENS', 50))
+
+CONTEXT_HEADER = "\n### YOUR STUDY MATERIALS (most relevant excerpts):\n"
+SOURCE_SEPARATOR = "---\n"
+
+def _truncate(text, max_tokens):
+    """Cut text to about max_tokens at a word boundary."""
+    max_chars = max_tokens * 4 - 2
+    cut = text.rfind(' ', 0, max_chars)
+    return text[:cut if cut > 0 else max_chars].rstrip() + " …"
+
+def pack_context(chunks, token_budget=CONTEXT_TOKEN_BUDGET, strategy=PACKING_STRATEGY):
+    """Fit retrieved chunks into the token budget of the study materials block.
+
+    Each source first gets its share of the budget (see PACKING_STRATEGY) and is
+    filled with its best chunks up to that share, so one long source can't crowd
+    out the others. Whatever is left is then handed out in relevance order,
+    cutting a chunk that fits only partly.
+
+    Args:
+        chunks: retrieved chunk dicts (content_id, position, title, text, tokens, score), best first
+    Returns:
+        tuple: (context text, {content_id: tokens used})
+    """
+    if not chunks:
+        return "", {}
+
+    by_source = {}  # content_id -> its chunks, best first; sources in order of their best chunk
+    for chunk in chunks:
+        by_source.setdefault(chunk["content_id"], []).append(chunk)
+    titles = {content_id: source_chunks[0]["title"] for content_id, source_chunks in by_source.items()}
+    overheads = {
+        content_id: estimate_tokens(f"#### {title}\n") + estimate_tokens(SOURCE_SEPARATOR)
+        for content_id, title in titles.items()
+    }
+
+    budget = token_budget - estimate_tokens(CONTEXT_HEADER)
+    weights = {content_id: 1.0 for content_id in by_source}
+    if strategy == "relevance":
+        scores = {content_id: sum(chunk["score"] for chunk in source_chunks) for content_id, source_chunks in by_source.items()}
+        if sum(scores.values()) > 0:
+            weights = scores
+    total_weight = sum(weights.values())
+
+    packed = {content_id: [] for content_id in by_source}  # content_id -> [(position, text)]
+    used = {content_id: 0 for content_id in by_source}
+    taken = set()
+    remaining = budget
+
+    def add(content_id, chunk, limit, allow_truncate):
+        nonlocal remaining
+        overhead = 0 if packed[content_id] else overheads[content_id]
+        room = min(limit, remaining) - overhead
+        text, tokens = chunk["text"], chunk["tokens"]
+        if tokens > room:
+            if not allow_truncate or room < MIN_TRUNCATED_TOKENS:
+                return False
+            text = _truncate(text, room)
+            tokens = estimate_tokens(text)
+        packed[content_id].append((chunk["position"], text))
+        used[content_id] += tokens + overhead
+        remaining -= tokens + overhead
+        taken.add(id(chunk))
+        return True
+
+    # Each source up to its share; only a source's first chunk is cut to fit, so
+    # every source with a big enough share gets into the prompt
+    for content_id, source_chunks in by_source.items():
+        share = int(budget * weights[content_id] / total_weight)
+        for chunk in source_chunks:
+            if not add(content_id, chunk, share - used[content_id], allow_truncate=not packed[content_id]):
+                break
+
+    # Unused shares go to the best remaining chunks
+    for chunk in chunks:
+        if remaining <= 0:
+            break
+        if id(chunk) not in taken:
+            add(chunk["content_id"], chunk, remaining, allow_truncate=True)
+
+    sections = [CONTEXT_HEADER]
+    for content_id, parts in packed.items():
+        if not parts:
+            continue
+        sections.append(f"#### {titles[content_id]}\n")
+        sections.extend(f"{text}\n" for _, text in sorted(parts))
+        sections.append(SOURCE_SEPARATOR)
+    context = "\n".join(sections)
+
+    # Keyed by source, not title: two sources can share a title
+    usage = {content_id: tokens for content_id, tokens in used.items() if tokens}
+    logger.info(
+        f"Packed study context: ~{token_budget - remaining}/{token_budget} tokens ({strategy}); "
+        + ", ".join(f"{titles[content_id]} ({content_id}): {tokens}" for content_id, tokens in usage.items())
+    )
+    return context, usage
@@ -0,0 +1,293 @@
+import math
+import os
+import re
+import threading
+import logging
+from collections import defaultdict
+from dotenv import load_dotenv
+from sqlalchemy import func
+from ..models.database import Session, Content, ContentChunk
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', 300))
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', 16))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 3000))
+# Cap on the chunks taken from one source, so other sources make it into the candidates
+MAX_CHUNKS_PER_SOURCE = int(os.getenv('MAX_CHUNKS_PER_SOURCE', 6))
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'does', 'for', 'from',
+    'how', 'i', 'in', 'is', 'it', 'me', 'of', 'on', 'or', 'that', 'the', 'this', 'to',
+    'what', 'when', 'where', 'which', 'who', 'why', 'with', 'you', 'your'
+}
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token)."""
+    return max(1, len(text) // 4) if text else 0
+
+def tokenize(text):
+    """Lowercase word tokens with stopwords removed."""
+    return [t for t in re.findall(r'[a-z0-9]+', text.lower()) if t not in STOPWORDS]
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS):
+    """Split text into chunks of roughly max_tokens, keeping paragraphs together where possible."""
+    if not text or not text.strip():
+        return []
+    max_chars = max_tokens * 4
+
+    # Break oversized paragraphs down to words so no piece exceeds the chunk size
+    pieces = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        current = []
+        length = 0
+        for word in paragraph.split():
+            if current and length + len(word) + 1 > max_chars:
+                pieces.append(' '.join(current))
+                current, length = [], 0
+            current.append(word)
+            length += len(word) + 1
+        if current:
+            pieces.append(' '.join(current))
+
+    # Pack pieces into chunks
+    chunks = []
+    current = []
+    length = 0
+    for piece in pieces:
+        if current and length + len(piece) + 2 > max_chars:
+            chunks.append('\n\n'.join(current))
+            current, length = [], 0
+        current.append(piece)
+        length += len(piece) + 2
+    if current:
+        chunks.append('\n\n'.join(current))
+    return chunks
+
+def _content_text(content):
+    """Text of a Content row that goes into the index: its analysis plus the source text itself."""
+    parts = [content.summary, content.key_points]
+    # Skip source text that merely repeats the summary
+    if content.content and not (content.summary and content.summary in content.content):
+        parts.append(content.content)
+    return '\n\n'.join(part for part in parts if part)
+
+class ChunkIndex:
+    """BM25 index over content chunks.
+
+    Chunks are persisted in the content_chunks table at ingestion time; the
+    inverted index is rebuilt from that table on first use and kept in memory,
+    so a query only touches the postings of its own terms.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._state = None  # (chunk count, max chunk id) the in-memory index reflects
+        self._chunks = {}  # chunk id -> (content_id, position, text, token_count, term count)
+        self._postings = defaultdict(dict)  # term -> {chunk id: term frequency}
+        self._total_terms = 0
+
+    def _db_state(self, session):
+        return tuple(session.query(func.count(ContentChunk.id), func.max(ContentChunk.id)).one())
+
+    def _add_to_memory(self, chunk):
+        terms = tokenize(chunk.text)
+        self._chunks[chunk.id] = (chunk.content_id, chunk.position, chunk.text, chunk.token_count, len(terms))
+        self._total_terms += len(terms)
+        frequencies = defaultdict(int)
+        for term in terms:
+            frequencies[term] += 1
+        for term, tf in frequencies.items():
+            self._postings[term][chunk.id] = tf
+
+    def _reset_memory(self):
+        self._chunks = {}
+        self._postings = defaultdict(dict)
+        self._total_terms = 0
+
+    def _write_chunks(self, session, content):
+        """Cut a Content row into chunks and store them; returns the new rows."""
+        rows = [
+            ContentChunk(content_id=content.id, position=position, text=text, token_count=estimate_tokens(text))
+            for position, text in enumerate(chunk_text(_content_text(content)))
+        ]
+        session.add_all(rows)
+        return rows
+
+    def _ensure_loaded(self):
+        """Load the index from the database, backfilling sources that were never chunked."""
+        with Session() as session:
+            if not self._loaded:
+                indexed = session.query(ContentChunk.content_id).distinct()
+                missing = session.query(Content).filter(~Content.id.in_(indexed)).all()
+                for content in missing:
+                    self._write_chunks(session, content)
+                if missing:
+                    session.commit()
+                    logger.info(f"Backfilled chunk index for {len(missing)} sources")
+
+            state = self._db_state(session)
+            if self._loaded and state == self._state:
+                return
+
+            # First use, or another process changed the table: rebuild from the database
+            self._reset_memory()
+            for chunk in session.query(ContentChunk).yield_per(1000):
+                self._add_to_memory(chunk)
+            self._state = state
+            self._loaded = True
+            logger.info(f"Chunk index loaded: {len(self._chunks)} chunks")
+
+    def index_content(self, content):
+        """Chunk a freshly stored Content row and add it to the index."""
+        with self._lock:
+            with Session() as session:
+                session.query(ContentChunk).filter(ContentChunk.content_id == content.id).delete()
+                rows = self._write_chunks(session, content)
+                session.commit()
+                if self._loaded:
+                    for chunk_id in [cid for cid, c in self._chunks.items() if c[0] == content.id]:
+                        self._remove_from_memory(chunk_id)
+                    for chunk in rows:
+                        self._add_to_memory(chunk)
+                    self._state = self._db_state(session)
+            logger.info(f"Indexed content {content.id} into {len(rows)} chunks")
+            return len(rows)
+
+    def _remove_from_memory(self, chunk_id):
+        content_id, position, text, token_count, length = self._chunks.pop(chunk_id)
+        self._total_terms -= length
+        for term in set(tokenize(text)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def remove_content(self, content_id):
+        """Drop all chunks of a deleted source."""
+        with self._lock:
+            with Session() as session:
+                session.query(ContentChunk).filter(ContentChunk.content_id == content_id).delete()
+                session.commit()
+                if self._loaded:
+                    for chunk_id in [cid for cid, c in self._chunks.items() if c[0] == content_id]:
+                        self._remove_from_memory(chunk_id)
+                    self._state = self._db_state(session)
+
+    def clear(self):
+        """Drop every chunk."""
+        with self._lock:
+            with Session() as session:
+                session.query(ContentChunk).delete()
+                session.commit()
+            self._reset_memory()
+            self._loaded = False
+            self._state = None
+
+    def chunk_count(self):
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._chunks)
+
+    def _score(self, query_terms, content_ids=None):
+        """BM25 scores for every chunk containing at least one query term, optionally limited to some sources."""
+        n = len(self._chunks)
+        avg_length = self._total_terms / n if n else 0
+        scores = defaultdict(float)
+        for term in set(query_terms):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                if content_ids is not None and self._chunks[chunk_id][0] not in content_ids:
+                    continue
+                length = self._chunks[chunk_id][4]
+                norm = 1 - BM25_B + BM25_B * (length / avg_length if avg_length else 0)
+                scores[chunk_id] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+        return scores
+
+    def search(self, query, top_k=RETRIEVAL_TOP_K, token_budget=CONTEXT_TOKEN_BUDGET, content_ids=None,
+               max_per_source=MAX_CHUNKS_PER_SOURCE):
+        """Return the top-k chunks relevant to the query that fit in the token budget.
+
+        content_ids, if given, restricts the search to those sources (e.g. the
+        result of a full-text pre-filter). With token_budget=None all top-k chunks
+        are returned, for the prompt packer to fit into the budget.
+
+        Returns:
+            list: dicts with content_id, title, type, text, tokens and score, best match first
+        """
+        with self._lock:
+            self._ensure_loaded()
+            scores = self._score(tokenize(query), set(content_ids) if content_ids else None)
+            if scores:
+                ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+            else:
+                # Nothing matched lexically (e.g. "summarize my notes"): fall back to the
+                # opening chunk of the most recent sources
+                ranked = sorted(
+                    ((cid, 0.0) for cid, c in self._chunks.items() if c[1] == 0),
+                    key=lambda item: item[0],
+                    reverse=True
+                )
+
+            selected = []
+            chosen = set()
+            per_source = defaultdict(int)
+            used = 0
+            # The first pass caps the chunks per source; the second fills any
+            # slots still free with the best of the rest
+            for cap in (max_per_source, None):
+                for chunk_id, score in ranked:
+                    if len(selected) >= top_k:
+                        break
+                    content_id, position, text, token_count, length = self._chunks[chunk_id]
+                    if chunk_id in chosen or (cap and per_source[content_id] >= cap):
+                        continue
+                    if token_budget is not None and used + token_count > token_budget:
+                        continue
+                    chosen.add(chunk_id)
+                    per_source[content_id] += 1
+                    selected.append({
+                        "content_id": content_id,
+                        "position": position,
+                        "text": text,
+                        "tokens": token_count,
+                        "score": score
+                    })
+                    used += token_count
+            selected.sort(key=lambda chunk: chunk["score"], reverse=True)
+
+        if selected:
+            with Session() as session:
+                rows = session.query(Content.id, Content.title, Content.type).filter(
+                    Content.id.in_({chunk["content_id"] for chunk in selected})
+                ).all()
+            sources = {row.id: row for row in rows}
+            selected = [chunk for chunk in selected if chunk["content_id"] in sources]
+            for chunk in selected:
+                chunk["title"] = sources[chunk["content_id"]].title
+                chunk["type"] = sources[chunk["content_id"]].type or "document"
+
+        logger.info(f"Retrieved {len(selected)} chunks ({used} tokens) for query")
+        return selected
+
+_index = ChunkIndex()
+
+def get_chunk_index():
+    """Process-wide chunk index shared by the app and the processors."""
+    return _index
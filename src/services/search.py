@@ -0,0 +1,74 @@
+import os
+import re
+import logging
+from dotenv import load_dotenv
+from sqlalchemy import text
+from ..models.database import Session
+from .retrieval import tokenize
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Libraries with more sources than this are pre-filtered lexically before chunk retrieval
+PREFILTER_MIN_SOURCES = int(os.getenv('PREFILTER_MIN_SOURCES', 200))
+PREFILTER_SOURCES = int(os.getenv('PREFILTER_SOURCES', 50))
+
+# bm25() column weights: title, summary, key_points, content
+COLUMN_WEIGHTS = (10.0, 4.0, 4.0, 1.0)
+
+SEARCH_SQL = text(f"""
+    SELECT c.id, c.title, c.type, c.source_type,
+           snippet(content_fts, -1, '**', '**', '…', 16) AS snippet,
+           bm25(content_fts, {', '.join(str(w) for w in COLUMN_WEIGHTS)}) AS rank
+    FROM content_fts
+    JOIN content c ON c.id = content_fts.rowid
+    WHERE content_fts MATCH :query
+    ORDER BY rank
+    LIMIT :limit
+""")
+
+IDS_SQL = text(f"""
+    SELECT rowid FROM content_fts
+    WHERE content_fts MATCH :query
+    ORDER BY bm25(content_fts, {', '.join(str(w) for w in COLUMN_WEIGHTS)})
+    LIMIT :limit
+""")
+
+def _terms(query):
+    return re.findall(r'\w+', query.lower())
+
+def to_match_query(query, match_all=True, prefix=True):
+    """Turn free text into an FTS5 MATCH expression.
+
+    Terms are quoted so user input can't inject FTS syntax. With prefix=True the
+    last term also matches as a prefix (search-as-you-type).
+    """
+    terms = _terms(query)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    if prefix:
+        quoted[-1] += '*'
+    return (' AND ' if match_all else ' OR ').join(quoted)
+
+def search_content(query, limit=50):
+    """Full-text search over sources.
+
+    Returns:
+        list: dicts with id, title, type, source_type, snippet and rank (lower is better)
+    """
+    match = to_match_query(query)
+    if match is None:
+        return []
+    with Session() as session:
+        rows = session.execute(SEARCH_SQL, {"query": match, "limit": limit}).mappings().all()
+    return [dict(row) for row in rows]
+
+def matching_content_ids(query, limit=PREFILTER_SOURCES):
+    """Ids of the sources best matching any term of a question, best first (for pre-filtering)."""
+    terms = tokenize(query)
+    if not terms:
+        return []
+    match = ' OR '.join(f'"{term}"' for term in terms)
+    with Session() as session:
+        return [row[0] for row in session.execute(IDS_SQL, {"query": match, "limit": limit})]